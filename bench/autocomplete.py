@@ -0,0 +1,71 @@
+"""Room name autocomplete latency from the in-memory RoomNameIndex.
+
+Usage: python bench/autocomplete.py [rooms] [queries]
+
+Builds one guild with the given number of rooms (4 members each, plus one member who
+belongs to 200 rooms) and times searches for every prefix of random room names, as a
+user typing would produce. For comparison it also times the old approach of scanning
+every room for membership, with the rooms already in memory."""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from autocomplete import RoomNameIndex
+
+GUILD_ID = 1
+WORDS = ["party", "chill", "floof", "den", "lair", "nest", "cave", "hideout", "lounge", "suite"]
+
+def build(rooms: int):
+    index = RoomNameIndex()
+    index.begin_load(GUILD_ID)
+    rows = []
+    members = rooms * 2
+    heavy_member = members + 1
+    heavy_rooms = set(random.sample(range(rooms), min(200, rooms)))
+    for i in range(rooms):
+        name = f"{random.choice(WORDS)} {random.choice(WORDS)} {i}"
+        room_members = random.sample(range(members), 4)
+        if i in heavy_rooms:
+            room_members.append(heavy_member)
+        rows.append((f"Hotel-{i}", name, tuple(room_members)))
+    index.finish_load(GUILD_ID, rows)
+    return index, rows, heavy_member
+
+def percentile(samples, q: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(q * len(samples)))]
+
+def report(title: str, samples):
+    print(f"{title}: {len(samples)} queries, p50 {percentile(samples, 0.5) * 1e6:.1f}us, "
+          f"p99 {percentile(samples, 0.99) * 1e6:.1f}us, mean {statistics.mean(samples) * 1e6:.1f}us")
+
+def time_queries(search, member_ids, rows, queries: int):
+    samples = []
+    for _ in range(queries):
+        member_id = random.choice(member_ids)
+        name = random.choice(rows)[1]
+        for length in range(0, len(name) + 1, 2):
+            start = time.perf_counter()
+            search(member_id, name[:length])
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def main(rooms: int, queries: int):
+    index, rows, heavy_member = build(rooms)
+    typical_members = [row[2][0] for row in random.sample(rows, min(1000, len(rows)))]
+
+    indexed = lambda member_id, current: index.search(GUILD_ID, member_id, current)
+    report(f"Index, typical member, {rooms} rooms", time_queries(indexed, typical_members, rows, queries))
+    report(f"Index, member of 200 rooms, {rooms} rooms", time_queries(indexed, [heavy_member], rows, queries))
+
+    def scan(member_id, current):
+        return [name for _, name, members in rows if member_id in members and current.lower() in name.lower()][:25]
+    report(f"Full scan, typical member, {rooms} rooms", time_queries(scan, typical_members, rows, max(1, queries // 10)))
+
+if __name__ == "__main__":
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    main(rooms, queries)
@@ -0,0 +1,174 @@
+"""Local stand-ins for the discord.py objects ConRoomManager touches, for benchmarks.
+
+Only the attributes and methods the room code uses are implemented. Every REST call goes
+through FakeAPI, which adds latency, enforces a per-channel rate limit the way Discord
+does for message endpoints, and counts calls by endpoint. Like discord.py, a 429 is
+retried internally after the retry-after delay, unless raise_rate_limits is set, in which
+case discord.RateLimited is raised as discord.py does past max_ratelimit_timeout."""
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import discord
+
+_ids = itertools.count(10**17)
+
+def snowflake() -> int:
+    return next(_ids)
+
+class FakeAPI:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, rate: int = 5, per: float = 5.0,
+                 raise_rate_limits: bool = False):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.per = per
+        self.raise_rate_limits = raise_rate_limits
+        self.calls = Counter()  # endpoint -> calls, 429s counted under "429"
+        self._windows = {}  # channel_id -> (window start, requests in window)
+
+    def _retry_after(self, channel_id: int) -> float:
+        now = time.monotonic()
+        start, used = self._windows.get(channel_id, (now, 0))
+        if now - start >= self.per:
+            start, used = now, 0
+        if used >= self.rate:
+            return start + self.per - now
+        self._windows[channel_id] = (start, used + 1)
+        return 0.0
+
+    async def request(self, endpoint: str, channel_id: int = None):
+        while True:
+            await asyncio.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+            self.calls[endpoint] += 1
+            retry_after = self._retry_after(channel_id) if channel_id is not None else 0.0
+            if not retry_after:
+                return
+            self.calls["429"] += 1
+            if self.raise_rate_limits:
+                raise discord.RateLimited(retry_after)
+            await asyncio.sleep(retry_after)
+
+def _not_found():
+    return discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+
+class FakeMessage:
+    """Both a sent message and a PartialMessage handle; edits of deleted messages raise NotFound"""
+    def __init__(self, channel: "FakeTextChannel", message_id: int):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **fields):
+        await self.channel.api.request("PATCH /channels/messages", self.channel.id)
+        if self.id not in self.channel.messages:
+            raise _not_found()
+        self.channel.messages[self.id] = fields
+
+    async def delete(self):
+        await self.channel.api.request("DELETE /channels/messages", self.channel.id)
+        if self.channel.messages.pop(self.id, None) is None:
+            raise _not_found()
+
+class FakeTextChannel:
+    def __init__(self, api: FakeAPI, channel_id: int = None):
+        self.api = api
+        self.id = channel_id or snowflake()
+        self.messages = {}  # message_id -> last sent fields
+
+    def seed_message(self) -> FakeMessage:
+        """A message that already exists, without an API call"""
+        message = FakeMessage(self, snowflake())
+        self.messages[message.id] = {}
+        return message
+
+    async def send(self, content: str = None, **fields):
+        await self.api.request("POST /channels/messages", self.id)
+        message = self.seed_message()
+        self.messages[message.id] = fields
+        return message
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self, message_id)
+
+class FakeGuild:
+    def __init__(self, guild_id: int = None):
+        self.id = guild_id or snowflake()
+        self.channels = {}
+
+    def add_channel(self, channel: FakeTextChannel):
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id, None)
+
+    def get_member(self, member_id: int):
+        return None
+
+    def get_role(self, role_id: int):
+        return None
+
+class FakeRole:
+    def __init__(self, role_id: int = None, manage_channels: bool = False, administrator: bool = False):
+        self.id = role_id or snowflake()
+        self.name = f"role-{self.id}"
+        self.permissions = SimpleNamespace(manage_channels=manage_channels, administrator=administrator)
+
+class FakeMember:
+    def __init__(self, guild: FakeGuild, roles=(), member_id: int = None):
+        self.id = member_id or snowflake()
+        self.guild = guild
+        self.roles = list(roles)
+        self.name = f"member-{self.id}"
+        self.display_name = self.name
+        self.mention = f"<@{self.id}>"
+        administrator = any(role.permissions.administrator for role in self.roles)
+        # Administrators get every permission, as in Discord
+        self.guild_permissions = SimpleNamespace(
+            administrator=administrator,
+            manage_channels=administrator or any(role.permissions.manage_channels for role in self.roles),
+            create_events=administrator)
+
+    def get_role(self, role_id: int):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content: str = None, ephemeral: bool = False, **fields):
+        await self.interaction.api.request("POST /interactions/callback")
+        self._done = True
+
+    async def defer(self, ephemeral: bool = False, thinking: bool = False):
+        await self.interaction.api.request("POST /interactions/callback")
+        self._done = True
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, content: str = None, ephemeral: bool = False, **fields):
+        await self.interaction.api.request("POST /webhooks")
+
+class FakeInteraction:
+    def __init__(self, api: FakeAPI, guild: FakeGuild, user: FakeMember, channel: FakeTextChannel):
+        self.api = api
+        self.guild = guild
+        self.user = user
+        self.channel = channel
+        # No channel overwrites, so channel permissions are the member's guild permissions
+        self.permissions = user.guild_permissions
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, content: str = None, **fields):
+        await self.api.request("PATCH /webhooks/messages")
@@ -0,0 +1,72 @@
+"""Event loop blocking time with ZODB commits run inline vs. on the storage executor.
+
+Usage: python bench/loop_lag.py [commits] [storage_threads]
+
+Each mode commits the same number of room-sized writes to a scratch FileStorage while
+monitor_loop_lag samples the loop, then prints the lag histogram for each."""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import ZODB, ZODB.FileStorage
+from BTrees import OOBTree
+import metrics
+import storage
+
+def open_db(directory: str, name: str):
+    db = ZODB.DB(ZODB.FileStorage.FileStorage(os.path.join(directory, name)))
+    with db.transaction() as conn:
+        conn.root.rooms = OOBTree.BTree()
+    return db
+
+def write_room(conn, i: int):
+    conn.root.rooms[f"Hotel-{i}"] = {"members": list(range(8)), "status": i % 3, "updated": time.time()}
+
+def print_histogram(title: str, histogram: metrics.Histogram):
+    print(f"\n{title}: {histogram.count} samples, p50 <= {histogram.quantile(0.5) * 1000:.1f}ms, "
+          f"p99 <= {histogram.quantile(0.99) * 1000:.1f}ms")
+    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+        print(f"  <= {bound * 1000:>7.1f}ms  {count:6d}  {'#' * min(60, count)}")
+
+def reset(histogram: metrics.Histogram):
+    histogram.counts = [0] * len(histogram.counts)
+    histogram.sum = 0.0
+    histogram.count = 0
+
+async def run_inline(db, commits: int):
+    for i in range(commits):
+        with db.transaction() as conn:
+            write_room(conn, i)
+        # Yield like an async handler would between commands
+        await asyncio.sleep(0)
+
+async def run_executor(executor: storage.StorageExecutor, commits: int):
+    await asyncio.gather(*(executor.write(lambda conn, i=i: write_room(conn, i)) for i in range(commits)))
+
+async def measure(title: str, work):
+    reset(storage.loop_lag)
+    monitor = asyncio.create_task(storage.monitor_loop_lag(interval=0.005))
+    start = time.perf_counter()
+    await work
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    print_histogram(f"{title} ({elapsed:.2f}s)", storage.loop_lag)
+
+async def main(commits: int, threads: int):
+    with tempfile.TemporaryDirectory() as directory:
+        db = open_db(directory, "inline.fs")
+        await measure(f"Before: {commits} commits on the event loop", run_inline(db, commits))
+        db.close()
+
+        executor = storage.StorageExecutor(open_db(directory, "executor.fs"), threads)
+        await measure(f"After: {commits} commits on {threads} storage threads", run_executor(executor, commits))
+        executor.close()
+
+if __name__ == "__main__":
+    commits = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    asyncio.run(main(commits, threads))
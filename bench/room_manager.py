@@ -0,0 +1,174 @@
+"""ConRoomManager throughput against a fake Discord guild.
+
+Usage: python bench/room_manager.py [--rooms 1000 10000 50000] [--ops 500] [--concurrency 50]
+                                    [--latency 0.05] [--rate 50] [--per 1.0]
+
+For each room count a fresh database is seeded directly (one card message per room, no
+API calls), then each operation is run --ops times by --concurrency simulated users at
+once: create_room, add_person_to_room, update_room_status, update_room_info,
+autocomplete_room_names (what the room_name autocomplete callback calls) and remove_room.
+Background card renders are drained before an operation's numbers are taken, so API
+calls per operation include them.
+
+REST calls go through fake_discord.FakeAPI with --latency seconds each and a per-channel
+limit of --rate requests per --per seconds. Discord's real limit is about 5 per 5s; the
+default is scaled up so a run finishes in minutes, and the render queue is configured to
+the same limit. 429s that still happen are reported as API calls under "429"."""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from ZODB.utils import p64, u64
+from fake_discord import FakeAPI, FakeGuild, FakeInteraction, FakeMember, FakeRole, FakeTextChannel
+from room import ConRoomManager, Room, RoomStatus, RoomVibe
+from storage import StorageConfig
+import room_index
+
+HOTELS = ["Marriott", "Hyatt", "Hilton", "Sheraton"]
+WORDS = ["party", "chill", "floof", "den", "lair", "nest", "cave", "hideout", "lounge", "suite"]
+SEED_BATCH_SIZE = 1000
+
+def percentile(samples, q: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(q * len(samples)))]
+
+class Bench:
+    def __init__(self, manager: ConRoomManager, api: FakeAPI, guild: FakeGuild, channel: FakeTextChannel):
+        self.manager = manager
+        self.api = api
+        self.guild = guild
+        self.channel = channel
+        self.admin_role = FakeRole(manage_channels=True, administrator=True)
+        self.admin = FakeMember(guild, [self.admin_role])
+        self.rooms = []  # (hotel, room_number, room_name, owner)
+
+    def interaction(self, user: FakeMember) -> FakeInteraction:
+        return FakeInteraction(self.api, self.guild, user, self.channel)
+
+    async def seed(self, count: int):
+        def configure(conn):
+            conn.root.room_channels[self.guild.id] = self.channel.id
+            conn.root.admin_roles[self.guild.id] = self.admin_role.id
+        await self.manager.storage.write(configure)
+        for i in range(count):
+            name = f"{random.choice(WORDS)} {random.choice(WORDS)} {i}"
+            self.rooms.append((random.choice(HOTELS), 1000 + i, name, FakeMember(self.guild)))
+        for start in range(0, count, SEED_BATCH_SIZE):
+            batch = [(hotel, number, name, owner, self.channel.seed_message())
+                     for hotel, number, name, owner in self.rooms[start:start + SEED_BATCH_SIZE]]
+            def state(conn):
+                guild_rooms = self.manager._guild(conn, self.guild.id, create=True)
+                for hotel, number, name, owner, message in batch:
+                    room = Room(owner, hotel, number, message, name)
+                    guild_rooms.rooms[room.key] = room
+                    room_index.index_room(guild_rooms, room, room.key)
+            await self.manager.storage.write(state)
+        start = time.perf_counter()
+        await self.manager.load_autocomplete()
+        print(f"  seeded {count} rooms, autocomplete loaded in {time.perf_counter() - start:.2f}s")
+
+    def commits_since(self, tid: bytes) -> int:
+        storage = self.manager.db.storage
+        if storage.lastTransaction() == tid:
+            return 0
+        return sum(1 for _ in storage.iterator(p64(u64(tid) + 1)))
+
+    async def run(self, title: str, ops: int, concurrency: int, op):
+        """Run op(i) ops times with at most concurrency in flight and print its numbers"""
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = Counter()
+        async def one(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await op(i)
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+        calls_before = Counter(self.api.calls)
+        tid = self.manager.db.storage.lastTransaction()
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(ops)))
+        elapsed = time.perf_counter() - start
+        await self.manager.render_queue.join()
+        commits = self.commits_since(tid)
+        calls = self.api.calls - calls_before
+        print(f"  {title:<18} p50 {percentile(latencies, 0.5) * 1000:7.1f}ms  p99 {percentile(latencies, 0.99) * 1000:7.1f}ms  "
+              f"{ops / elapsed:8.1f} ops/s  {commits / elapsed:7.1f} commits/s  "
+              f"{sum(calls.values()) / ops:5.2f} API calls/op")
+        if calls:
+            print(f"  {'':<18} " + ", ".join(f"{endpoint} {count / ops:.2f}" for endpoint, count in sorted(calls.items())))
+        if errors:
+            print(f"  {'':<18} errors: " + ", ".join(f"{name} x{count}" for name, count in errors.items()))
+
+    async def run_all(self, ops: int, concurrency: int):
+        ops = min(ops, len(self.rooms) // 4)
+        # Each operation gets its own rooms so later ones aren't skewed by earlier changes
+        picks = random.sample(self.rooms, ops * 4)
+        add_rooms, status_rooms, info_rooms, remove_rooms = (picks[i * ops:(i + 1) * ops] for i in range(4))
+        creator = FakeMember(self.guild, [FakeRole(manage_channels=True)])
+
+        async def create(i):
+            await self.manager.create_room(self.interaction(creator), creator, "Bench", i, f"new room {i}")
+        async def add(i):
+            hotel, number, _, owner = add_rooms[i]
+            await self.manager.add_person_to_room(FakeMember(self.guild), self.interaction(owner), hotel, number)
+        async def status(i):
+            hotel, number, _, owner = status_rooms[i]
+            await self.manager.update_room_status(self.interaction(owner), random.choice(list(RoomStatus)),
+                                                  random.choice(list(RoomVibe)), None, hotel, number)
+        async def info(i):
+            hotel, number, name, _ = info_rooms[i]
+            await self.manager.update_room_info(self.interaction(self.admin), hotel, number, new_room_name=f"{name} renamed")
+        async def autocomplete(i):
+            _, _, name, owner = random.choice(self.rooms)
+            await self.manager.autocomplete_room_names(owner, name[:random.randint(0, len(name))])
+        async def remove(i):
+            hotel, number, _, _ = remove_rooms[i]
+            await self.manager.remove_room(self.interaction(self.admin), hotel, number)
+
+        await self.run("create_room", ops, concurrency, create)
+        await self.run("add_person", ops, concurrency, add)
+        await self.run("update_status", ops, concurrency, status)
+        await self.run("update_info", ops, concurrency, info)
+        await self.run("autocomplete", ops, concurrency, autocomplete)
+        await self.run("remove_room", ops, concurrency, remove)
+
+async def main(args):
+    logging.getLogger().setLevel(logging.ERROR)
+    for rooms in args.rooms:
+        print(f"\n{rooms} rooms, {args.concurrency} concurrent users, {args.latency * 1000:.0f}ms REST latency, "
+              f"{args.rate} requests per {args.per}s per channel")
+        with tempfile.TemporaryDirectory() as directory:
+            manager = ConRoomManager(storage_threads=args.storage_threads,
+                                     storage_config=StorageConfig(os.path.join(directory, "rooms.fs")))
+            manager.render_queue.rate = args.rate
+            manager.render_queue.per = args.per
+            manager.render_queue.debounce = args.debounce
+            api = FakeAPI(latency=args.latency, rate=args.rate, per=args.per)
+            guild = FakeGuild()
+            channel = guild.add_channel(FakeTextChannel(api))
+            bench = Bench(manager, api, guild, channel)
+            await bench.seed(rooms)
+            await bench.run_all(args.ops, args.concurrency)
+            manager.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ConRoomManager against a fake Discord guild")
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--ops", type=int, default=500, help="operations of each kind")
+    parser.add_argument("--concurrency", type=int, default=50, help="simulated users issuing commands at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per REST call")
+    parser.add_argument("--rate", type=int, default=50, help="requests allowed per channel per --per seconds")
+    parser.add_argument("--per", type=float, default=1.0)
+    parser.add_argument("--debounce", type=float, default=0.1, help="render queue debounce in seconds")
+    parser.add_argument("--storage-threads", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
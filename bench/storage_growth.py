@@ -0,0 +1,111 @@
+"""Storage file growth and open time over a con's worth of room status updates.
+
+Usage: python bench/storage_growth.py [--rooms 2000] [--updates 50000] [--concurrency 8]
+                                      [--cache-size 5000] [--pack-days 0]
+
+For each storage mode a fresh database is seeded with --rooms rooms, then --updates status
+updates are committed one transaction each, the way /update_room_status does, with all
+the room indexes maintained. Then it reports the file size and how long the database takes
+to open after a clean close (saved .index), after an unclean one (.index missing, so the
+whole file is scanned) and after an online pack keeping --pack-days of history.
+
+Every revision in the benchmark is minutes old, so the default --pack-days 0 stands in for
+packing with a day of retention at the end of a real weekend."""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from fake_discord import FakeGuild, FakeMember
+from room import GuildRooms, Room, RoomStatus, RoomVibe
+from storage import StorageBusyError, StorageConfig, StorageExecutor, STORAGE_MODES, open_db
+import room_index
+
+SEED_BATCH_SIZE = 1000
+
+def timed_open(config: StorageConfig):
+    start = time.perf_counter()
+    db = open_db(config)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+def size(path: str) -> str:
+    return f"{os.path.getsize(path) / 1e6:8.1f}MB"
+
+async def simulate(config: StorageConfig, args):
+    executor = StorageExecutor(open_db(config))
+    guild = FakeGuild()
+    owners = [FakeMember(guild) for _ in range(args.rooms)]
+    def create(conn):
+        conn.root.guilds = {guild.id: GuildRooms()}
+    await executor.write(create)
+    for start in range(0, args.rooms, SEED_BATCH_SIZE):
+        def seed(conn, start=start):
+            guild_rooms = conn.root.guilds[guild.id]
+            for i in range(start, min(start + SEED_BATCH_SIZE, args.rooms)):
+                room = Room(owners[i], "Hotel", 1000 + i, room_name=f"room {i}")
+                guild_rooms.rooms[room.key] = room
+                room_index.index_room(guild_rooms, room, room.key)
+        await executor.write(seed)
+    seeded = os.path.getsize(config.path)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failed = []
+    async def update(i: int):
+        room_key = f"Hotel-{1000 + random.randrange(args.rooms)}"
+        status, vibe = random.choice(list(RoomStatus)), random.choice(list(RoomVibe))
+        def state(conn):
+            guild_rooms = conn.root.guilds[guild.id]
+            room = guild_rooms.rooms[room_key]
+            room_index.unindex_updated(guild_rooms, room, room_key)
+            room_index.unindex_status(guild_rooms, room, room_key)
+            room.update_status(owners[0], status, vibe, is_admin=True)
+            room_index.index_updated(guild_rooms, room, room_key)
+            room_index.index_status(guild_rooms, room, room_key)
+        async with semaphore:
+            try:
+                await executor.write(state)
+            except StorageBusyError:
+                failed.append(i)
+    start = time.perf_counter()
+    await asyncio.gather(*(update(i) for i in range(args.updates)))
+    elapsed = time.perf_counter() - start
+    print(f"  seeded {seeded / 1e6:.1f}MB, {args.updates} updates in {elapsed:.1f}s ({args.updates / elapsed:.0f}/s), "
+          f"{len(failed)} gave up after conflict retries")
+    executor.close()
+
+    print(f"  {'after updates':<22} {size(config.path)}  open {timed_open(config) * 1000:7.1f}ms with .index")
+    os.remove(config.path + ".index")
+    print(f"  {'':<22} {'':>10}  open {timed_open(config) * 1000:7.1f}ms without .index")
+
+    executor = StorageExecutor(open_db(config))
+    start = time.perf_counter()
+    await executor.pack(args.pack_days)
+    elapsed = time.perf_counter() - start
+    executor.close()
+    old = f", {size(config.path + '.old').strip()} kept as .old" if os.path.exists(config.path + ".old") else ""
+    print(f"  {'packed in ' + f'{elapsed:.1f}s':<22} {size(config.path)}  open {timed_open(config) * 1000:7.1f}ms with .index{old}")
+
+async def main(args):
+    logging.getLogger().setLevel(logging.ERROR)
+    for mode in STORAGE_MODES:
+        print(f"\n{mode} mode, {args.rooms} rooms, {args.updates} status updates")
+        with tempfile.TemporaryDirectory() as directory:
+            config = StorageConfig(os.path.join(directory, "rooms.fs"), cache_size=args.cache_size, mode=mode)
+            await simulate(config, args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure storage growth, packing and open time")
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=50000, help="status updates, one transaction each")
+    parser.add_argument("--concurrency", type=int, default=8, help="updates in flight at once")
+    parser.add_argument("--cache-size", type=int, default=5000, help="objects cached per connection")
+    parser.add_argument("--pack-days", type=float, default=0, help="days of history the pack keeps")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+# Discord accepts at most 25 autocomplete choices
+MAX_CHOICES = 25
+
+def rank_names(names, current: str, limit: int = MAX_CHOICES):
+    """Filter names containing current and order them exact match, prefix, word prefix, then substring"""
+    needle = current.strip().casefold()
+    ranked = []
+    for name in names:
+        folded = name.casefold()
+        position = folded.find(needle)
+        if position < 0:
+            continue
+        if folded == needle:
+            rank = 0
+        elif position == 0:
+            rank = 1
+        elif not folded[position - 1].isalnum():
+            rank = 2
+        else:
+            rank = 3
+        ranked.append((rank, len(name), folded, name))
+    ranked.sort()
+    return [name for _, _, _, name in ranked[:limit]]
+
+class GuildRoomNames:
+    def __init__(self):
+        self.names = {}  # room_key -> room_name, named rooms only
+        self.members = {}  # member_id -> set of room keys
+        self.room_members = {}  # room_key -> member ids, to unlink a room without scanning members
+        self.loaded = False
+        # Room keys changed while the initial load was running; the load must not overwrite them
+        self.touched = None
+
+class RoomNameIndex:
+    """In-process copy of each guild's room names and memberships, used to answer
+    autocomplete without touching storage.
+
+    The manager updates it after every committed room mutation. A guild is only used for
+    lookups once its initial load from storage has finished; until then callers fall back
+    to reading storage."""
+
+    def __init__(self):
+        self._guilds = {}
+
+    def _guild(self, guild_id: int) -> GuildRoomNames:
+        guild = self._guilds.get(guild_id, None)
+        if guild is None:
+            guild = GuildRoomNames()
+            self._guilds[guild_id] = guild
+        return guild
+
+    def is_loaded(self, guild_id: int) -> bool:
+        guild = self._guilds.get(guild_id, None)
+        return guild is not None and guild.loaded
+
+    def begin_load(self, guild_id: int):
+        self._guild(guild_id).touched = set()
+
+    def finish_load(self, guild_id: int, rooms):
+        """Install the rooms read from storage, given as (room_key, room_name, member_ids) tuples"""
+        guild = self._guild(guild_id)
+        touched = guild.touched or set()
+        for room_key, room_name, member_ids in rooms:
+            if room_key not in touched:
+                self._set(guild, room_key, room_name, member_ids)
+        guild.touched = None
+        guild.loaded = True
+
+    def invalidate(self, guild_id: int):
+        """Forget a guild so the next lookup falls back to storage until it is reloaded"""
+        self._guilds.pop(guild_id, None)
+
+    def _set(self, guild: GuildRoomNames, room_key: str, room_name: str, member_ids):
+        self._remove(guild, room_key)
+        if room_name:
+            guild.names[room_key] = room_name
+        guild.room_members[room_key] = tuple(member_ids)
+        for member_id in member_ids:
+            guild.members.setdefault(member_id, set()).add(room_key)
+
+    def _remove(self, guild: GuildRoomNames, room_key: str):
+        guild.names.pop(room_key, None)
+        for member_id in guild.room_members.pop(room_key, ()):
+            keys = guild.members.get(member_id, None)
+            if keys is None:
+                continue
+            keys.discard(room_key)
+            if not keys:
+                del guild.members[member_id]
+
+    def set_room(self, guild_id: int, room_key: str, room_name: str, member_ids):
+        guild = self._guild(guild_id)
+        if guild.touched is not None:
+            guild.touched.add(room_key)
+        self._set(guild, room_key, room_name, member_ids)
+
+    def remove_room(self, guild_id: int, room_key: str):
+        guild = self._guild(guild_id)
+        if guild.touched is not None:
+            guild.touched.add(room_key)
+        self._remove(guild, room_key)
+
+    def search(self, guild_id: int, member_id: int, current: str, limit: int = MAX_CHOICES):
+        """Names of the member's rooms matching current, best matches first"""
+        guild = self._guilds[guild_id]
+        keys = guild.members.get(member_id, ())
+        return rank_names((guild.names[room_key] for room_key in keys if room_key in guild.names), current, limit)
@@ -0,0 +1,174 @@
+import itertools
+import persistent
+from BTrees import LOBTree
+from dataclasses import dataclass, field
+import room_index
+
+# Discord allows at most 10 embeds per message
+BOARD_PAGE_SIZE = 10
+# Render queue keys for board pages are prefixed so they can't collide with room keys
+BOARD_TARGET_PREFIX = "board:"
+
+class BoardPage(persistent.Persistent):
+    """One board message and the rooms shown on it, in slot order"""
+    channel_id = None
+    # Sort entry of the page's first room, so relayout can find where a change lands
+    first_entry = None
+
+    def __init__(self, message_id: int = None, room_keys: tuple = ()):
+        self.message_id = message_id
+        self.room_keys = room_keys
+
+@dataclass
+class BoardChanges:
+    """What relayout changed, for the Discord side effects applied after commit"""
+    # Room channel the board is laid out in
+    channel_id: int = None
+    # Existing board messages whose rooms changed and need a re-render
+    changed_message_ids: list = field(default_factory=list)
+    # Indexes of pages that have no message yet and need to be posted
+    new_pages: list = field(default_factory=list)
+    # Board messages no longer needed
+    removed_message_ids: list = field(default_factory=list)
+
+# Board sort -> the room index (see room_index) its pages are read from, in order. Statuses
+# sort in the order RoomStatus declares them.
+BOARD_SORTS = {
+    "location": "location_index",
+    "status": "status_index",
+}
+
+def sort_entry(mode: str, room, room_key: str) -> tuple:
+    """The room's entry in the index a board sorted by mode is read from"""
+    location = room_index.location_entry(room, room_key)
+    return location if mode == "location" else (room._status,) + location
+
+def changed_span(mode: str, *entries):
+    """What relayout needs to know about a change that added, removed or moved rooms at these
+    sort entries, or None if the guild has no board"""
+    return (mode, min(entries), max(entries)) if mode else None
+
+def board_target(message_id: int) -> str:
+    return f"{BOARD_TARGET_PREFIX}{message_id}"
+
+# GuildRooms.board_index maps each posted page's message_id to its BoardPage, so a page is
+# found by its message without walking the board. It is updated in the same transaction as
+# the page's message_id.
+
+def index_page(guild_rooms, page: BoardPage):
+    if page.message_id:
+        guild_rooms.board_index[page.message_id] = page
+
+def unindex_page(guild_rooms, page: BoardPage):
+    if page.message_id and page.message_id in guild_rooms.board_index:
+        del guild_rooms.board_index[page.message_id]
+
+def rebuild_board_index(guild_rooms):
+    guild_rooms.board_index = LOBTree.BTree()
+    for page in guild_rooms.board or ():
+        index_page(guild_rooms, page)
+
+def _first_affected_page(board, entry: tuple) -> int:
+    """Index of the page a room sorting at entry is on or would be added to"""
+    low, high = 0, len(board)
+    while low < high:
+        middle = (low + high) // 2
+        first = board[middle].first_entry
+        if first is None:
+            # Laid out before pages kept their first entry
+            return 0
+        if first < entry:
+            low = middle + 1
+        else:
+            high = middle
+    return max(0, low - 1)
+
+def relayout(guild_rooms, channel_id: int, changed: tuple = None) -> BoardChanges:
+    """Lay the guild's rooms out into pages of BOARD_PAGE_SIZE in its board sort and update
+    the board to match.
+
+    Pages are read from the sort's room index, so rooms are only loaded where their page or
+    slot changed. changed is a changed_span; the board is assumed to be laid out already
+    apart from it, so pages before it are left alone and the walk stops at the first page
+    past it that still lines up. Without it every page is checked.
+
+    Pages are compared with the current board one by one, so only pages whose room list
+    actually changed are reported for re-rendering. Rooms are pointed at their page's
+    message and slot, and are only written when that changed."""
+    mode = guild_rooms.board_mode
+    index = getattr(guild_rooms, BOARD_SORTS[mode])
+    board = guild_rooms.board
+    if changed is not None and changed[0] != mode:
+        # The sort was switched since the change was made
+        changed = None
+    start = _first_affected_page(board, changed[1]) if changed and board else 0
+    entries = iter(index.keys(min=board[start].first_entry) if start else index.keys())
+    changes = BoardChanges(channel_id)
+    count = start
+    while True:
+        page_entries = list(itertools.islice(entries, BOARD_PAGE_SIZE))
+        if not page_entries:
+            break
+        page_keys = tuple(entry[-1] for entry in page_entries)
+        if count == len(board):
+            board.append(BoardPage(None, page_keys))
+            changes.new_pages.append(count)
+            same = False
+        else:
+            page = board[count]
+            same = page.room_keys == page_keys
+            if not same:
+                page.room_keys = page_keys
+                if page.message_id:
+                    changes.changed_message_ids.append(page.message_id)
+            if not page.message_id:
+                changes.new_pages.append(count)
+        page = board[count]
+        count += 1
+        # A status change can move a room without moving it off its page
+        if page.first_entry != page_entries[0]:
+            page.first_entry = page_entries[0]
+        if changed and same:
+            if page_entries[0] > changed[2]:
+                # Past the change and lined up again, so every later page is unchanged too
+                return changes
+            # Its rooms already point at it
+            continue
+        for slot, room_key in enumerate(page_keys):
+            room = guild_rooms.rooms[room_key]
+            if room.message_id != page.message_id or room.board_slot != slot:
+                room.message_id = page.message_id
+                room.channel_id = channel_id if page.message_id else None
+                room.board_slot = slot
+    for page in board[count:]:
+        unindex_page(guild_rooms, page)
+    changes.removed_message_ids = [page.message_id for page in board[count:] if page.message_id]
+    del board[count:]
+    return changes
+
+def attach_page(guild_rooms, index: int, message_id: int, channel_id: int, sent_keys: tuple):
+    """Record the message posted for a new page. Returns (attached, stale): attached is False
+    if the page was dropped or posted by someone else meanwhile, so the message should be
+    deleted; stale is True if the page's rooms changed since it was posted."""
+    if index >= len(guild_rooms.board) or guild_rooms.board[index].message_id:
+        return False, False
+    page = guild_rooms.board[index]
+    move_page(guild_rooms, page, message_id, channel_id)
+    return True, page.room_keys != sent_keys
+
+def move_page(guild_rooms, page: BoardPage, message_id: int, channel_id: int):
+    """Point a page and its rooms at a newly posted message"""
+    unindex_page(guild_rooms, page)
+    page.message_id = message_id
+    page.channel_id = channel_id
+    index_page(guild_rooms, page)
+    for room_key in page.room_keys:
+        room = guild_rooms.rooms.get(room_key, None)
+        if room is not None:
+            room.message_id = message_id
+            room.channel_id = channel_id
+
+def find_page(guild_rooms, message_id: int):
+    if guild_rooms is None or guild_rooms.board_index is None:
+        return None
+    return guild_rooms.board_index.get(message_id, None)
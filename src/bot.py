@@ -1,15 +1,62 @@
-from room import ConRoomManager, RoomStatus, RoomVibe
+from room import ConRoomManager, RoomStatus, RoomVibe, STATUS_EMOJI, describe_change
+from event import ConEventManager
 import os
 import discord
 from discord import app_commands
 import dotenv
 import logging
 from utils import follow_up
+from room_import import parse_room_import
+from storage import monitor_loop_lag, run_packer, StorageConfig
+from pagination import CursorPaginator
+import instrumentation
+import asyncio
+import signal
+import time
+from command_sync import sync_if_changed
+from typing import Literal
+
+# Restart-to-ready time is measured from here
+STARTED = time.perf_counter()
 
 logger = logging.getLogger('conbot')
 logger.setLevel(logging.INFO)
 env = dotenv.load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Threads used for ZODB transactions, each with its own connection, for rooms and for events
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", "4"))
+EVENT_STORAGE_THREADS = int(os.getenv("EVENT_STORAGE_THREADS", "2"))
+# Hours a room status stays current without updates before its card is greyed out, 0 to never expire
+STATUS_TTL_HOURS = float(os.getenv("STATUS_TTL_HOURS", "12"))
+# Prometheus text endpoint at http://METRICS_HOST:METRICS_PORT/metrics, port 0 to disable
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Database files, relative to the working directory unless absolute
+ROOMS_DB_PATH = os.getenv("ROOMS_DB_PATH", "rooms.fs")
+EVENTS_DB_PATH = os.getenv("EVENTS_DB_PATH", "events.fs")
+# Objects and approximate bytes (0 for no limit) cached per storage connection
+STORAGE_CACHE_SIZE = int(os.getenv("STORAGE_CACHE_SIZE", "5000"))
+STORAGE_CACHE_BYTES = int(os.getenv("STORAGE_CACHE_BYTES", "0"))
+# "file" keeps STORAGE_PACK_DAYS of history and a .old copy on pack, "compact" keeps neither
+STORAGE_MODE = os.getenv("STORAGE_MODE", "file")
+STORAGE_PACK_DAYS = float(os.getenv("STORAGE_PACK_DAYS", "1"))
+# Hours between online packs of both databases, 0 to never pack
+STORAGE_PACK_INTERVAL_HOURS = float(os.getenv("STORAGE_PACK_INTERVAL_HOURS", "6"))
+# Share storage with other bot processes through a ZEO server ("host:port" or a socket path)
+# instead of opening the files directly. Run one with runzeo -C zeo.conf; see zeo.conf.example.
+ZEO_ADDRESS = os.getenv("ZEO_ADDRESS", "") or None
+ZEO_ROOMS_STORAGE = os.getenv("ZEO_ROOMS_STORAGE", "rooms")
+ZEO_EVENTS_STORAGE = os.getenv("ZEO_EVENTS_STORAGE", "events")
+# Total shards across every process, and the comma-separated shards this process runs.
+# Unset, discord.py picks the shard count and this process runs all of them.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()] or None
+# With shared storage only the process running shard 0 packs, so packs don't overlap
+PACKS_STORAGE = not ZEO_ADDRESS or SHARD_IDS is None or 0 in SHARD_IDS
+
+def storage_config(path: str, zeo_storage: str) -> StorageConfig:
+    return StorageConfig(path, cache_size=STORAGE_CACHE_SIZE, cache_size_bytes=STORAGE_CACHE_BYTES,
+                         mode=STORAGE_MODE, pack_days=STORAGE_PACK_DAYS, zeo_address=ZEO_ADDRESS, zeo_storage=zeo_storage)
 
 def is_valid_name(name: str) -> bool:
         if len(name) < 3 or len(name) > 30:
@@ -18,19 +65,42 @@ def is_valid_name(name: str) -> bool:
 
 
 # Initialize command based bot. Should probably make most be ephemeral?
+# Message Content and Server Members are privileged intents: each has to be switched on for
+# the bot under Bot > Privileged Gateway Intents in the Discord developer portal, or Discord
+# refuses the connection.
 intents = discord.Intents.default()
 intents.message_content = True
+# Member join/leave/update events keep room cards in sync with the guild
+intents.members = True
+
+# Comma-separated guilds to register commands in directly, which takes effect immediately.
+# GUILD_ID is the older single-guild setting. With neither, commands are registered
+# globally, which Discord can take up to an hour to roll out.
+GUILD_IDS = [int(guild_id) for guild_id in os.getenv("GUILD_IDS", os.getenv("GUILD_ID", "")).split(",") if guild_id.strip()]
+COMMAND_GUILDS = [discord.Object(id=guild_id) for guild_id in GUILD_IDS] or [None]
+# Signatures of the last synced command tree per guild; commands are only synced when it changes
+COMMAND_SIGNATURES_PATH = os.getenv("COMMAND_SIGNATURES_PATH", "command_signatures.json")
+# Sync commands on start even if unchanged, e.g. after they were edited outside the bot
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "") not in ("", "0")
 
-# Temporary guild ID
-GUILD_ID = int(os.getenv("GUILD_ID"))
-TEST_GUILD = discord.Object(id=GUILD_ID)
+class InstrumentedCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Runs in the task that then runs the command, so the command name set here
+        # labels the storage and REST work the handler does
+        instrumentation.start_command(interaction)
+        return True
 
-class ConBot(discord.Client):
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        instrumentation.finish_command(interaction)
+        instrumentation.record_error(interaction, getattr(error, "original", error))
+
+# Sharded even when one process runs every shard, so scaling out is only configuration
+class ConBot(discord.AutoShardedClient):
     # Suppress error on the User attribute being None since it fills up later
     user: discord.ClientUser
 
     def __init__(self, *, intents: discord.Intents):
-        super().__init__(intents=intents)
+        super().__init__(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
         # A CommandTree is a special type that holds all the application command
         # state required to make it work. This is a separate class because it
         # allows all the extra state to be opt-in.
@@ -38,25 +108,117 @@ class ConBot(discord.Client):
         # to store and work with them.
         # Note: When using commands.Bot instead of discord.Client, the bot will
         # maintain its own tree instead.
-        self.tree = app_commands.CommandTree(self)
+        self.tree = InstrumentedCommandTree(self)
+
+    async def sync_commands(self):
+        # Global commands are copied to each configured guild so they show up right away
+        for guild in COMMAND_GUILDS:
+            if guild is not None:
+                self.tree.copy_global_to(guild=guild)
+        await sync_if_changed(self.tree, COMMAND_GUILDS, COMMAND_SIGNATURES_PATH, force=FORCE_COMMAND_SYNC)
 
-    # In this basic example, we just synchronize the app commands to one guild.
-    # Instead of specifying a guild to every command, we copy over our global commands instead.
-    # By doing so, we don't have to wait up to an hour until they are shown to the end-user.
+    # Runs after login and before the gateway connects, so no events arrive until it returns
     async def setup_hook(self):
-        # This copies the global commands over to your guild.
-        self.tree.copy_global_to(guild=TEST_GUILD)
-        await self.tree.sync(guild=TEST_GUILD)
+        instrumentation.install(self)
+        if METRICS_PORT:
+            self.metrics_runner = await instrumentation.serve_metrics(METRICS_HOST, METRICS_PORT)
+        # Storage has been opening since before login; sync commands while it finishes
+        await asyncio.gather(self.sync_commands(), self.storage_ready)
+        # Track event loop stalls so slow storage or handlers show up in metrics
+        self.loop_lag_task = asyncio.create_task(monitor_loop_lag())
+        # Autocomplete reads storage until this finishes, then answers from memory
+        self.autocomplete_task = asyncio.create_task(con_room_manager.load_autocomplete(self))
+        self.expiry_task = asyncio.create_task(con_room_manager.run_expiry_sweeper(self))
+        if ZEO_ADDRESS:
+            # Other processes change rooms and settings this one caches
+            self.cache_sync_task = asyncio.create_task(con_room_manager.run_cache_sync(self))
+        if STORAGE_PACK_INTERVAL_HOURS and PACKS_STORAGE:
+            self.pack_tasks = [asyncio.create_task(run_packer(manager.storage, STORAGE_PACK_INTERVAL_HOURS * 3600, manager.storage_config.retention_days))
+                               for manager in (con_room_manager, con_event_manager)]
+        # discord.py only shuts down cleanly on Ctrl+C; treat SIGTERM from a service manager the same
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except NotImplementedError:
+            pass
+
+    async def close(self):
+        await super().close()
+        if con_room_manager is not None:
+            try:
+                await con_room_manager.change_log.flush()
+            except Exception:
+                logger.exception("Writing the room change log on shutdown failed")
+        # A clean close saves the FileStorage indexes, so the next start doesn't rescan the files
+        for manager in (con_room_manager, con_event_manager):
+            if manager is not None:
+                manager.close()
 bot = ConBot(intents=intents)
 
-# Initialize managers
-con_room_manager = ConRoomManager()
+# Managers are opened by open_managers once the bot starts
+con_room_manager = None
+con_event_manager = None
+
+async def event_access(interaction: discord.Interaction):
+    """Permissions for both managers, resolved from the room manager's guild settings"""
+    return await con_room_manager.access(interaction)
+
+async def open_managers():
+    """Open both databases at once on threads. Opening scans the file when its index wasn't
+    saved, and migrations run here too, so neither should hold up the event loop."""
+    global con_room_manager, con_event_manager
+    con_room_manager, con_event_manager = await asyncio.gather(
+        asyncio.to_thread(ConRoomManager, storage_threads=STORAGE_THREADS, status_ttl=STATUS_TTL_HOURS * 3600 or None,
+                          storage_config=storage_config(ROOMS_DB_PATH, ZEO_ROOMS_STORAGE)),
+        asyncio.to_thread(ConEventManager, event_access, storage_threads=EVENT_STORAGE_THREADS,
+                          storage_config=storage_config(EVENTS_DB_PATH, ZEO_EVENTS_STORAGE)))
 
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user} (ID: {bot.user.id})')
+    print(f'Ready {time.perf_counter() - STARTED:.1f}s after start')
     print('------')
 
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    instrumentation.finish_command(interaction)
+
+async def report_error(interaction: discord.Interaction, error: Exception):
+    """Tell the user what went wrong and record it"""
+    instrumentation.record_error(interaction, error)
+    await follow_up(interaction, str(error), ephemeral=True)
+
+@bot.event
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    # The raw event also fires for members who weren't in the member cache
+    guild = bot.get_guild(payload.guild_id)
+    if guild is not None:
+        await con_room_manager.remove_departed_member(guild, payload.user.id)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.display_name != after.display_name:
+        await con_room_manager.invalidate_member_cards(after.guild.id, after.id)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    con_room_manager.guild_settings.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    con_room_manager.guild_settings.invalidate(role.guild.id)
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    guild = bot.get_guild(payload.guild_id) if payload.guild_id else None
+    if guild is not None:
+        await con_room_manager.handle_messages_deleted(guild, payload.channel_id, [payload.message_id])
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    guild = bot.get_guild(payload.guild_id) if payload.guild_id else None
+    if guild is not None:
+        await con_room_manager.handle_messages_deleted(guild, payload.channel_id, list(payload.message_ids))
+
 # Set admin role (Administrator only, hidden from general users)
 @bot.tree.command(name="set_admin_role")
 @app_commands.default_permissions(administrator=True)
@@ -64,13 +226,12 @@ async def set_admin_role(interaction, role: discord.Role):
     response_parts = []
 
     # Check permissions first
-    if not interaction.user.guild_permissions.administrator:
+    if not (await con_room_manager.access(interaction)).administrator:
         response_parts.append("❌ **Permission Denied**: You must have Administrator permission to set the admin role.")
     else:
         try:
             # Get the current admin role before setting the new one
-            with con_room_manager.db.transaction() as conn:
-                old_admin_role_id = con_room_manager.get_admin_role_id(interaction.guild.id, conn)
+            old_admin_role_id = await con_room_manager.fetch_admin_role_id(interaction.guild.id)
 
             old_role = None
             if old_admin_role_id:
@@ -89,8 +250,7 @@ async def set_admin_role(interaction, role: discord.Role):
 
     # Always show current admin role configuration
     try:
-        with con_room_manager.db.transaction() as conn:
-            current_admin_role_id = con_room_manager.get_admin_role_id(interaction.guild.id, conn)
+        current_admin_role_id = await con_room_manager.fetch_admin_role_id(interaction.guild.id)
 
         if current_admin_role_id:
             current_role = interaction.guild.get_role(current_admin_role_id)
@@ -108,15 +268,14 @@ async def set_admin_role(interaction, role: discord.Role):
 # Set room channel
 @bot.tree.command(name="set_room_channel")
 async def set_room_channel(interaction):
-    if interaction.user.guild_permissions.manage_channels == False:
+    if not (await con_room_manager.access(interaction)).manage_channels:
         await follow_up(interaction, "You do not have permission to set room channels.", ephemeral=True)
         return
     try:
         await con_room_manager.set_room_channel(interaction.user, interaction)
         await follow_up(interaction, "Room channel set successfully.", ephemeral=True)
     except Exception as e:
-        await follow_up(interaction, str(e), ephemeral=True)
-        raise e
+        await report_error(interaction, e)
 
 # Create room
 @bot.tree.command(name="create_room")
@@ -124,31 +283,51 @@ async def create_room(interaction, hotel: str, room_number: int, room_name: str
     try:
         await con_room_manager.create_room(interaction, interaction.user, hotel, room_number, room_name)
     except Exception as e:
-        await follow_up(interaction, str(e), ephemeral=True)
+        await report_error(interaction, e)
     
+# Bulk create rooms from a CSV or JSON room list
+@bot.tree.command(name="import_rooms")
+async def import_rooms(interaction, file: discord.Attachment):
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        rows = parse_room_import(file.filename, await file.read())
+        async def progress(text):
+            await interaction.edit_original_response(content=text)
+        posted = await con_room_manager.import_rooms(interaction, interaction.user, rows, progress)
+        await interaction.edit_original_response(content=f"Imported {len(rows)} rooms and posted {posted} card messages.")
+    except Exception as e:
+        await report_error(interaction, e)
+
 # Add person to room
 @bot.tree.command(name="add_person_to_room")
 async def add_person_to_room(interaction, person: discord.Member, hotel: str = None, room_number: int = None):
     try:
         await con_room_manager.add_person_to_room(person, interaction, hotel, room_number)
     except Exception as e:
-        await follow_up(interaction, str(e), ephemeral=True)
+        await report_error(interaction, e)
 
 # Autocomplete function for room names
 async def room_name_autocomplete(interaction: discord.Interaction, current: str):
     try:
-        with con_room_manager.db.transaction() as conn:
-            # Get all rooms where the user is a member
-            user_rooms = [room for room in conn.root.rooms.values() if room.person_in_room(interaction.user) and room.room_name]
-            # Filter by current input and return up to 25 choices
-            choices = [
-                app_commands.Choice(name=room.room_name, value=room.room_name)
-                for room in user_rooms
-                if current.lower() in room.room_name.lower()
-            ][:25]
-            return choices
-    except Exception:
+        room_names = await con_room_manager.autocomplete_room_names(interaction.user, current)
+        return [app_commands.Choice(name=room_name, value=room_name) for room_name in room_names]
+    except Exception as e:
+        instrumentation.record_error(interaction, e)
         return []
+    finally:
+        # Autocomplete doesn't fire on_app_command_completion
+        instrumentation.finish_command(interaction)
+
+# Switch between one card per room and a consolidated room board (Admin only)
+@bot.tree.command(name="set_room_board")
+@app_commands.default_permissions(administrator=True)
+async def set_room_board(interaction, mode: Literal["off", "location", "status"]):
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        await con_room_manager.set_board_mode(interaction, None if mode == "off" else mode)
+        await follow_up(interaction, "Room cards are now one message per room." if mode == "off" else f"Room board enabled, sorted by {mode}.", ephemeral=True)
+    except Exception as e:
+        await report_error(interaction, e)
 
 # Update room status
 @bot.tree.command(name="update_room_status")
@@ -157,7 +336,7 @@ async def update_room_status(interaction, status: RoomStatus, vibe: RoomVibe, ro
     try:
         await con_room_manager.update_room_status(interaction, status, vibe, room_name, hotel, room_number)
     except Exception as e:
-        await follow_up(interaction, str(e), ephemeral=True)
+        await report_error(interaction, e)
 
 # Update room info (Admin only)
 @bot.tree.command(name="update_room_info")
@@ -175,7 +354,7 @@ async def update_room_info(interaction, old_hotel: str, old_room_number: int, ne
         changes_text = ", ".join(changes) if changes else "no changes"
         await follow_up(interaction, f"Room updated successfully. Changed: {changes_text}.", ephemeral=True)
     except Exception as e:
-        await follow_up(interaction, str(e), ephemeral=True)
+        await report_error(interaction, e)
 
 # Remove room
 @bot.tree.command(name="remove_room")
@@ -184,6 +363,144 @@ async def remove_room(interaction, hotel: str, room_number: int):
         await con_room_manager.remove_room(interaction, hotel, room_number)
         await follow_up(interaction, f"Room {hotel} {room_number} removed successfully.", ephemeral=True)
     except Exception as e:
-        await follow_up(interaction, str(e), ephemeral=True)
+        await report_error(interaction, e)
+
+# Choose the category new event channels are created in
+@bot.tree.command(name="set_event_category")
+@app_commands.default_permissions(manage_channels=True)
+async def set_event_category(interaction, category: discord.CategoryChannel = None):
+    try:
+        await con_event_manager.set_event_category(interaction, category)
+        await follow_up(interaction, f"Event channels will be created in {category.name}." if category else "Event channels will be created outside any category.", ephemeral=True)
+    except Exception as e:
+        await report_error(interaction, e)
+
+# Create an event with its own role and hidden text and voice channels
+@bot.tree.command(name="create_event")
+async def create_event(interaction, role_name: str, channel_name: str):
+    try:
+        # Creating a role and two channels can take longer than the response deadline
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        channel_id = await con_event_manager.create_event(interaction, role_name, channel_name)
+        await follow_up(interaction, f"Event <#{channel_id}> created successfully.", ephemeral=True)
+    except Exception as e:
+        await report_error(interaction, e)
+
+# Add people to an event, by mention or ID, separated by spaces or commas
+@bot.tree.command(name="add_people_to_event")
+async def add_people_to_event(interaction, people: str, channel: discord.TextChannel = None):
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        added, problems = await con_event_manager.add_people(interaction, people, channel)
+        message = "\n".join([f"Added {added} people to the event."] + problems[:20])
+        await follow_up(interaction, message[:2000], ephemeral=True)
+    except Exception as e:
+        await report_error(interaction, e)
+
+# List the server's events, or only your own
+@bot.tree.command(name="list_events")
+async def list_events(interaction, mine: bool = False):
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        async def fetch(cursor):
+            events, next_cursor = await con_event_manager.list_events(interaction, mine, cursor)
+            return "\n".join(f"<#{event.text_channel_id}> by <@{event.owner_id}>" for event in events), next_cursor
+        await CursorPaginator(interaction.user.id, fetch).start(interaction, "No events.")
+    except Exception as e:
+        await report_error(interaction, e)
+
+def room_line(card) -> str:
+    name = f" {card.room_name}" if card.room_name else ""
+    status = "Expired" if card.stale else card.status.value.name
+    return f"{'⬜' if card.stale else STATUS_EMOJI.get(card.status, '⬜')} **{card.hotel} {card.room_number}**{name}: {status}, {card.vibe.value.name}, {len(card.members)} members"
+
+async def send_room_list(interaction: discord.Interaction, **filters):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    async def fetch(cursor):
+        cards, next_cursor = await con_room_manager.list_rooms(interaction.guild.id, cursor, **filters)
+        return "\n".join(room_line(card) for card in cards), next_cursor
+    await CursorPaginator(interaction.user.id, fetch).start(interaction, "No rooms found.")
+
+# List rooms, optionally filtered by hotel, status, vibe and member
+@bot.tree.command(name="list_rooms")
+async def list_rooms(interaction, hotel: str = None, status: RoomStatus = None, vibe: RoomVibe = None, member: discord.Member = None):
+    try:
+        await send_room_list(interaction, hotel=hotel, status=status, vibe=vibe, member_id=member.id if member else None)
+    except Exception as e:
+        await report_error(interaction, e)
+
+# Find rooms by the start of their name, or a member's rooms
+@bot.tree.command(name="find_room")
+async def find_room(interaction, name: str = None, member: discord.Member = None):
+    try:
+        if not name and member is None:
+            raise ValueError("Give a room name or a member to search for.")
+        await send_room_list(interaction, name=name, member_id=member.id if member else None)
+    except Exception as e:
+        await report_error(interaction, e)
+
+# Who changed a room and how, newest first (Admin only)
+@bot.tree.command(name="room_history")
+@app_commands.default_permissions(administrator=True)
+async def room_history(interaction, hotel: str, room_number: int):
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        async def fetch(cursor):
+            entries, next_cursor = await con_room_manager.room_history(interaction, hotel, room_number, cursor)
+            return "\n".join(describe_change(entry) for entry in entries), next_cursor
+        await CursorPaginator(interaction.user.id, fetch).start(interaction, "No changes recorded for that room.")
+    except Exception as e:
+        await report_error(interaction, e)
+
+# Put a room back to how it was after a change listed by /room_history (Admin only)
+@bot.tree.command(name="restore_room")
+@app_commands.default_permissions(administrator=True)
+async def restore_room(interaction, hotel: str, room_number: int, change: int):
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        entry = await con_room_manager.restore_room(interaction, hotel, room_number, change)
+        await follow_up(interaction, f"Room {hotel} {room_number} restored to {describe_change(entry)}", ephemeral=True)
+    except Exception as e:
+        await report_error(interaction, e)
+
+# Delete an event's channels and role (event creator or admin)
+@bot.tree.command(name="cleanup_event")
+async def cleanup_event(interaction, channel: discord.TextChannel = None):
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        name = await con_event_manager.cleanup_event(interaction, channel)
+        # The reply may have been in the event channel itself, so it can fail harmlessly
+        await follow_up(interaction, f"Event {name} cleaned up.", ephemeral=True)
+    except discord.NotFound:
+        pass
+    except Exception as e:
+        await report_error(interaction, e)
+
+# Command latency, storage, Discord REST and queue metrics (Admin only)
+@bot.tree.command(name="bot_stats")
+@app_commands.default_permissions(administrator=True)
+async def bot_stats(interaction):
+    access = await con_room_manager.access(interaction)
+    if not access.administrator and not access.room_admin:
+        await follow_up(interaction, "You do not have permission to view bot stats.", ephemeral=True)
+        return
+    stats = instrumentation.format_stats()
+    # Discord messages are capped at 2000 characters
+    await follow_up(interaction, stats if len(stats) <= 2000 else stats[:1997] + "...", ephemeral=True)
+
+async def main():
+    discord.utils.setup_logging(root=False)
+    async with bot:
+        # Open storage while logging in; setup_hook waits for it before the gateway connects
+        bot.storage_ready = asyncio.create_task(open_managers())
+        await bot.start(BOT_TOKEN)
 
-bot.run(BOT_TOKEN)
\ No newline at end of file
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    # Closing the bot on the way out already closed storage
+    pass
+except discord.PrivilegedIntentsRequired:
+    logger.critical("Discord refused the bot's privileged intents. Turn on Server Members and Message Content "
+                    "under Bot > Privileged Gateway Intents in the Discord developer portal, then restart.")
+    raise SystemExit(1)
\ No newline at end of file
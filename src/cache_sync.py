@@ -0,0 +1,44 @@
+import asyncio
+from BTrees.Length import Length
+
+# Seconds between checks for guilds other processes changed, when storage is shared
+CACHE_SYNC_INTERVAL = 2.0
+
+# Each GuildRooms has a revision counter, a BTrees Length, bumped by every transaction that
+# changes something a process may cache about the guild: its settings, and its rooms via
+# the change log flush. Length resolves concurrent bumps by adding them up, so bumping
+# never causes a conflict. A process compares the counters with its own bumps to tell when
+# another process changed a guild, and then drops what it caches for that guild.
+
+def bump_revision(guild_rooms):
+    if guild_rooms.revision is None:
+        guild_rooms.revision = Length()
+    guild_rooms.revision.change(1)
+
+def read_revisions(conn) -> dict:
+    """guild_id -> revision for every guild, inside a transaction"""
+    return {guild_id: guild_rooms.revision() if guild_rooms.revision is not None else 0
+            for guild_id, guild_rooms in conn.root.guilds.items()}
+
+class CacheRevisions:
+    """The revision of each guild this process's caches reflect.
+
+    Hold lock from before committing a bump until local_change has counted it, and while
+    reading revisions for changed_elsewhere, so a check never sees this process's own bump
+    before it has been counted."""
+
+    def __init__(self, revisions: dict = None):
+        self._seen = dict(revisions or {})
+        self.lock = asyncio.Lock()
+
+    def local_change(self, guild_id: int):
+        """Count a bump this process committed, so it isn't mistaken for another process's"""
+        self._seen[guild_id] = self._seen.get(guild_id, 0) + 1
+
+    def changed_elsewhere(self, revisions: dict) -> list:
+        """Guilds whose revision moved past what this process accounts for. They are
+        marked seen, so each change is only reported once."""
+        changed = [guild_id for guild_id, revision in revisions.items() if revision > self._seen.get(guild_id, 0)]
+        for guild_id in changed:
+            self._seen[guild_id] = revisions[guild_id]
+        return changed
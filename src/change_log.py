@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from BTrees import LOBTree, OOBTree
+from cache_sync import CacheRevisions, bump_revision
+
+logger = logging.getLogger('conbot')
+
+# Seconds changes wait in memory before being written, so a burst shares one transaction
+FLUSH_DELAY = 1.0
+# Changes written per transaction at most
+FLUSH_BATCH_SIZE = 500
+# Changes per /room_history page
+HISTORY_PAGE_SIZE = 10
+
+# Each guild's log lives on its GuildRooms (see room.py), created with the first change:
+#   change_log:    entry ID -> (action, actor ID, room key, state, detail), in time order.
+#                  Entry IDs are microseconds since the epoch, bumped to stay unique.
+#   history_index: set of (room key, entry ID), for one room's changes
+# Entries are plain tuples, stored inline in the log's buckets rather than as objects of
+# their own. state is the room's state after the change, as ConRoomManager encodes it, or
+# None when there is no room left to describe.
+
+@dataclass(frozen=True)
+class ChangeEntry:
+    """One logged change to a room"""
+    entry_id: int
+    action: str
+    # None for changes the bot made on its own, like expiring a status
+    actor_id: int
+    room_key: str
+    state: tuple
+    # Action specific, e.g. the member added or the other key of a moved room
+    detail: object = None
+
+    @property
+    def when(self) -> datetime:
+        return datetime.fromtimestamp(self.entry_id / 1e6, timezone.utc)
+
+def append_entries(guild_rooms, entries):
+    """Append (entry ID, entry tuple) pairs to the guild's log and index them"""
+    if guild_rooms.change_log is None:
+        guild_rooms.change_log = LOBTree.BTree()
+        guild_rooms.history_index = OOBTree.TreeSet()
+    for entry_id, entry in entries:
+        # Another process may have logged in the same microsecond
+        while entry_id in guild_rooms.change_log:
+            entry_id += 1
+        guild_rooms.change_log[entry_id] = entry
+        guild_rooms.history_index.add((entry[2], entry_id))
+
+def get_entry(guild_rooms, entry_id: int) -> ChangeEntry:
+    entry = guild_rooms.change_log.get(entry_id, None) if guild_rooms.change_log is not None else None
+    return ChangeEntry(entry_id, *entry) if entry is not None else None
+
+def room_history(guild_rooms, room_key: str, before: int = None, limit: int = HISTORY_PAGE_SIZE):
+    """One page of a room's changes, newest first, as (entries, next cursor). Pass the cursor
+    as before for the next page; it is None on the last one."""
+    if guild_rooms.history_index is None:
+        return [], None
+    entries = []
+    # BTrees only iterate forwards, so walk backwards one maxKey lookup at a time
+    bound = (room_key, before - 1 if before is not None else 2**63 - 1)
+    while len(entries) <= limit:
+        try:
+            key, entry_id = guild_rooms.history_index.maxKey(bound)
+        except ValueError:
+            break
+        if key != room_key:
+            break
+        entries.append(get_entry(guild_rooms, entry_id))
+        bound = (room_key, entry_id - 1)
+    if len(entries) > limit:
+        return entries[:limit], entries[limit - 1].entry_id
+    return entries, None
+
+class ChangeLog:
+    """Buffers room changes and appends them to their guilds' logs in batches.
+
+    Changes are recorded after the transaction that made them commits, so the log never
+    shows a change that was rolled back, and recording one is just a list append. The cost
+    is that changes made in the last FLUSH_DELAY before a crash can be missing from the log."""
+
+    def __init__(self, storage, guild, revisions: CacheRevisions):
+        self.storage = storage
+        # guild(conn, guild_id, create=True) returns the guild's GuildRooms
+        self.guild = guild
+        # Each flush bumps the guilds it wrote to, telling other processes their rooms changed
+        self.revisions = revisions
+        self._pending = []  # (guild_id, entry ID, entry tuple)
+        self._last_id = 0
+        self._flusher = None
+        self._lock = asyncio.Lock()
+
+    def _next_id(self) -> int:
+        self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+        return self._last_id
+
+    def record(self, guild_id: int, room_key: str, actor_id: int, action: str, state: tuple, detail=None):
+        self._pending.append((guild_id, self._next_id(), (action, actor_id, room_key, state, detail)))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f"Writing {len(self._pending)} room changes failed, keeping them for the next flush")
+
+    async def flush(self):
+        """Write every pending change. Waits for a flush already in progress, so once this
+        returns everything recorded before the call is in storage."""
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:FLUSH_BATCH_SIZE]
+                del self._pending[:FLUSH_BATCH_SIZE]
+                by_guild = {}
+                for guild_id, entry_id, entry in batch:
+                    by_guild.setdefault(guild_id, []).append((entry_id, entry))
+                def state(conn):
+                    for guild_id, entries in by_guild.items():
+                        guild_rooms = self.guild(conn, guild_id, create=True)
+                        append_entries(guild_rooms, entries)
+                        bump_revision(guild_rooms)
+                try:
+                    async with self.revisions.lock:
+                        await self.storage.write(state)
+                        for guild_id in by_guild:
+                            self.revisions.local_change(guild_id)
+                except BaseException:
+                    self._pending[:0] = batch
+                    raise
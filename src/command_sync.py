@@ -0,0 +1,58 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import discord
+from discord import app_commands
+
+logger = logging.getLogger('conbot')
+
+def tree_signature(tree: app_commands.CommandTree, guild: discord.abc.Snowflake = None) -> str:
+    """Hash of the command payloads tree.sync(guild=guild) would upload"""
+    payloads = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                      key=lambda payload: (payload["name"], payload.get("type", 1)))
+    return hashlib.sha256(json.dumps(payloads, sort_keys=True).encode()).hexdigest()
+
+def _load_signatures(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning(f"Ignoring unreadable command signatures in {path}")
+        return {}
+
+def _save_signatures(path: str, signatures: dict):
+    # Write and rename, so a crash mid-write can't leave a half-written file behind
+    with open(path + ".tmp", "w") as file:
+        json.dump(signatures, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+async def sync_if_changed(tree: app_commands.CommandTree, guilds, path: str, force: bool = False) -> int:
+    """Sync the tree to each guild (None for global commands) whose commands changed since
+    the signature saved in path, concurrently. Returns how many were synced.
+
+    Syncing is a rate-limited REST call per guild, and unchanged commands don't need it, so
+    restarts skip it. Set force if commands were changed or deleted outside this bot."""
+    signatures = {} if force else _load_signatures(path)
+    application_id = tree.client.application_id
+    async def sync(guild) -> bool:
+        key = f"{application_id}:{guild.id if guild else 'global'}"
+        signature = tree_signature(tree, guild)
+        if signatures.get(key, None) == signature:
+            return False
+        await tree.sync(guild=guild)
+        # Only recorded once Discord has them, so a failed sync is retried next start
+        signatures[key] = signature
+        return True
+    results = await asyncio.gather(*(sync(guild) for guild in guilds), return_exceptions=True)
+    synced = sum(1 for result in results if result is True)
+    if synced:
+        _save_signatures(path, {**_load_signatures(path), **signatures})
+    logger.info(f"Synced commands to {synced} of {len(results)} targets, the rest were unchanged")
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return synced
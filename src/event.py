@@ -1,47 +1,211 @@
 import discord
 import persistent
-import ZODB, ZODB.FileStorage
-from BTrees import OOBTree
-import os
+from BTrees import LOBTree, LLBTree
+import asyncio
+import itertools
+from dataclasses import dataclass
 import logging
 from utils import is_valid_name
+from storage import StorageExecutor, StorageConfig, open_db, run_startup
+from room_import import parse_member_ids
+
+# Role additions in flight at once for a bulk add. discord.py queues requests past Discord's
+# per-route limits itself; this just keeps a big batch from monopolizing the HTTP client.
+ROLE_ADD_CONCURRENCY = 5
+# Events per /list_events page
+EVENT_PAGE_SIZE = 15
 
 class ConEventManager:
-    def __init__(self):
-        db_exists = os.path.exists("events.fs")
-        self.db = ZODB.DB(ZODB.FileStorage.FileStorage("events.fs"))
-        if not db_exists:
-            with self.db.transaction() as conn:
-                conn.root.events = OOBTree.BTree()
+    def __init__(self, access, storage_threads: int = 2, storage_config: StorageConfig = None):
+        # access(interaction) resolves the user's permissions, shared with ConRoomManager
+        self.access = access
+        self.storage_config = storage_config or StorageConfig("events.fs")
+        self.db = open_db(self.storage_config)
+        def create(conn):
+            # A new database, whether a new file or a new storage on a ZEO server
+            if not hasattr(conn.root, 'guilds') and not hasattr(conn.root, 'events'):
+                conn.root.guilds = LOBTree.BTree()  # guild_id -> GuildEvents
+                conn.root.event_categories = LOBTree.BTree()  # guild_id -> category channel id
+        run_startup(self.db, create)
+        def upgrade(conn):
+            # Existing databases keep every event in one tree keyed by text channel, split them up once
+            if not hasattr(conn.root, 'guilds'):
+                self._migrate_to_guild_events(conn)
+        run_startup(self.db, upgrade)
+        self.storage = StorageExecutor(self.db, storage_threads)
 
-    def event_manager(self, interaction: discord.Interaction):
-        guild = interaction.guild
-        owner = interaction.user
-        if all([role.permissions.create_events == False for role in owner.roles]):
-            raise PermissionError("You do not have permission to create events.")
+    def close(self):
+        self.storage.close()
+
+    def _migrate_to_guild_events(self, conn):
+        conn.root.guilds = LOBTree.BTree()
+        conn.root.event_categories = LOBTree.BTree()
+        events = getattr(conn.root, 'events', None) or {}
+        for event in events.values():
+            guild_events = self._guild(conn, event.guild_id, create=True)
+            guild_events.add(event)
+        if hasattr(conn.root, 'events'):
+            del conn.root.events
+        logging.info(f"Migrated {len(events)} events to per-guild storage")
 
-    async def set_room_channel(self, requestor: discord.Member, interaction: discord.Interaction):
-        if all([role.permissions.manage_channels == False for role in requestor.roles]):
-            raise PermissionError("You do not have permission to set room channels.")
-        with self.db.transaction() as conn: 
-            conn.root.room_channels[interaction.guild.id] = interaction.channel.id
+    def _guild(self, conn, guild_id: int, create: bool = False):
+        guild_events = conn.root.guilds.get(guild_id, None)
+        if guild_events is None and create:
+            guild_events = GuildEvents()
+            conn.root.guilds[guild_id] = guild_events
+        return guild_events
+
+    async def _check_event_access(self, interaction: discord.Interaction, owner_id: int):
+        """Event owners, administrators and the room admin role may manage an event"""
+        access = await self.access(interaction)
+        if interaction.user.id != owner_id and not access.administrator and not access.room_admin:
+            raise PermissionError("Only the event's creator or an admin can manage this event.")
+
+    async def _find_event(self, interaction: discord.Interaction, channel: discord.abc.GuildChannel = None) -> "EventInfo":
+        channel_id = channel.id if channel else interaction.channel.id
+        def state(conn):
+            guild_events = self._guild(conn, interaction.guild.id)
+            event = guild_events.events.get(channel_id, None) if guild_events else None
+            return EventInfo.from_event(event) if event else None
+        event = await self.storage.read(state)
+        if event is None:
+            raise ValueError("That channel is not an event channel.")
+        return event
+
+    async def set_event_category(self, interaction: discord.Interaction, category: discord.CategoryChannel = None):
+        """Create event channels under category, or at the top of the channel list if None"""
+        if not (await self.access(interaction)).manage_channels:
+            raise PermissionError("You do not have permission to set the event category.")
+        def state(conn):
+            if category is None:
+                conn.root.event_categories.pop(interaction.guild.id, None)
+            else:
+                conn.root.event_categories[interaction.guild.id] = category.id
+        await self.storage.write(state)
 
     async def create_event(self, interaction: discord.Interaction, role_name, channel_name):
         guild = interaction.guild
         owner = interaction.user
-        if all([role.permissions.create_events == False for role in owner.roles]):
+        if not (await self.access(interaction)).create_events:
             raise PermissionError("You do not have permission to create events.")
         if not is_valid_name(role_name) or not is_valid_name(channel_name):
             raise ValueError("Role or channel name is invalid. Must be 3-30 characters long and contain only alphanumeric characters, underscores, or hyphens.")
+        category_id = await self.storage.read(lambda conn: conn.root.event_categories.get(guild.id, None))
+        category = guild.get_channel(category_id) if category_id else None
         logging.info(f"Creating event {channel_name} with role {role_name} in guild {guild.name} ({guild.id}) by user {owner.name} ({owner.id})")
         event = Event(guild, owner)
-        logging.info(f"Event object created for {channel_name}")
-        logging.info("Setting up event...")
-        await event.setup(guild, owner, role_name, channel_name)
+        event.name = channel_name
+        created = await event.setup(guild, owner, role_name, channel_name, category)
+        def state(conn):
+            self._guild(conn, guild.id, create=True).add(event)
+        try:
+            await self.storage.write(state)
+        except Exception:
+            # Nothing refers to the new role and channels, don't leave them behind
+            await Event.delete_objects(guild, created)
+            raise
         logging.info(f"Event {channel_name} setup complete.")
-        with self.db.transaction() as conn:
-            conn.root.events[event.text_channel_id] = event
-        await interaction.response.send_message(f"Event '{channel_name}' created successfully.", ephemeral=True)
+        return event.text_channel_id
+
+    async def add_people(self, interaction: discord.Interaction, people: str, channel: discord.TextChannel = None):
+        """Give the event role to every member mentioned or listed by ID in people, several at a
+        time. Returns (added member count, list of problems)."""
+        event = await self._find_event(interaction, channel)
+        await self._check_event_access(interaction, event.owner_id)
+        role = interaction.guild.get_role(event.role_id)
+        if role is None:
+            raise ValueError("The event's role no longer exists.")
+        member_ids, invalid = parse_member_ids(people)
+        problems = [f"'{entry}' is not a member ID or mention." for entry in invalid]
+        if not member_ids:
+            raise ValueError("\n".join(problems) or "No members given.")
+        semaphore = asyncio.Semaphore(ROLE_ADD_CONCURRENCY)
+        async def add(member_id: int):
+            async with semaphore:
+                member = interaction.guild.get_member(member_id)
+                try:
+                    if member is None:
+                        member = await interaction.guild.fetch_member(member_id)
+                    await member.add_roles(role, reason=f"Added to event {event.name} by {interaction.user.id}")
+                    return None
+                except discord.NotFound:
+                    return f"<@{member_id}> is not in this server."
+                except discord.HTTPException as e:
+                    return f"Could not add <@{member_id}>: {e.text or e.status}"
+        results = await asyncio.gather(*(add(member_id) for member_id in member_ids))
+        problems.extend(result for result in results if result)
+        return sum(1 for result in results if result is None), problems
+
+    async def list_events(self, interaction: discord.Interaction, mine: bool = False, cursor: int = None, limit: int = EVENT_PAGE_SIZE):
+        """One page of EventInfo for the guild's events, or only the user's when mine is set,
+        in text channel ID (creation) order. Returns (events, next cursor), the cursor being the
+        last channel ID listed, or None on the last page."""
+        def state(conn):
+            guild_events = self._guild(conn, interaction.guild.id)
+            if guild_events is None:
+                return [], None
+            channel_ids = guild_events.owner_index.get(interaction.user.id, None) if mine else guild_events.events
+            if channel_ids is None:
+                return [], None
+            # One past the page tells whether there is a next one
+            page = list(itertools.islice(channel_ids.keys(min=cursor, excludemin=cursor is not None), limit + 1))
+            next_cursor = page[limit - 1] if len(page) > limit else None
+            return [EventInfo.from_event(guild_events.events[channel_id]) for channel_id in page[:limit]], next_cursor
+        return await self.storage.read(state)
+
+    async def cleanup_event(self, interaction: discord.Interaction, channel: discord.TextChannel = None):
+        """Delete an event's channels and role and forget it. Returns the event's name."""
+        event = await self._find_event(interaction, channel)
+        await self._check_event_access(interaction, event.owner_id)
+        def state(conn):
+            guild_events = self._guild(conn, interaction.guild.id)
+            stored = guild_events.events.get(event.text_channel_id, None) if guild_events else None
+            if stored is None:
+                raise ValueError("That event was already cleaned up.")
+            guild_events.remove(stored)
+        # Forget it first so a concurrent cleanup can't delete the same objects twice
+        await self.storage.write(state)
+        guild = interaction.guild
+        await Event.delete_objects(guild, [guild.get_channel(event.text_channel_id) if event.text_channel_id else None,
+                                           guild.get_channel(event.voice_channel_id) if event.voice_channel_id else None,
+                                           guild.get_role(event.role_id) if event.role_id else None])
+        return event.name
+
+@dataclass
+class EventInfo:
+    """Plain snapshot of an Event, safe to use outside its transaction"""
+    owner_id: int
+    role_id: int
+    text_channel_id: int
+    voice_channel_id: int
+    guild_id: int
+    name: str
+
+    @classmethod
+    def from_event(cls, event: "Event"):
+        return cls(event.owner_id, event.role_id, event.text_channel_id, event.voice_channel_id, event.guild_id, event.name)
+
+class GuildEvents(persistent.Persistent):
+    """One guild's events and their owner index"""
+    def __init__(self):
+        self.events = LOBTree.BTree()  # text_channel_id -> Event
+        self.owner_index = LOBTree.BTree()  # owner_id -> set of text_channel_ids
+
+    def add(self, event: "Event"):
+        self.events[event.text_channel_id] = event
+        channel_ids = self.owner_index.get(event.owner_id, None)
+        if channel_ids is None:
+            channel_ids = LLBTree.TreeSet()
+            self.owner_index[event.owner_id] = channel_ids
+        channel_ids.add(event.text_channel_id)
+
+    def remove(self, event: "Event"):
+        del self.events[event.text_channel_id]
+        channel_ids = self.owner_index.get(event.owner_id, None)
+        if channel_ids is not None:
+            channel_ids.discard(event.text_channel_id)
+            if not channel_ids:
+                del self.owner_index[event.owner_id]
 
 class Event(persistent.Persistent):
     # Creator of the event, can add more people
@@ -50,43 +214,50 @@ class Event(persistent.Persistent):
     text_channel_id = None
     voice_channel_id = None
     guild_id = None
-    
+    name = None
+
     def __init__(self, guild: discord.Guild, owner: discord.Member):
         self.owner_id = owner.id
         self.guild_id = guild.id
 
-    async def setup(self, guild: discord.Guild, owner: discord.Member, role_name, channel_name):
-        # Create role
+    async def setup(self, guild: discord.Guild, owner: discord.Member, role_name, channel_name, category: discord.CategoryChannel = None) -> list:
+        """Create the role, then the text and voice channels and the owner's role assignment
+        concurrently. If any step fails, everything created so far is deleted again.
+        Returns the created role and channels."""
         role = await guild.create_role(name=role_name)
         self.role_id = role.id
-        # Assign admin the role
-        await owner.add_roles(role)
-        # Create the channel and assign it viewable to the role
-        #TODO: Add sending to the right category?
-        text_channel = await guild.create_text_channel(f"{channel_name}", overwrites={
+        overwrites = {
             guild.default_role: discord.PermissionOverwrite(view_channel=False),
             role: discord.PermissionOverwrite(view_channel=True)
-        })
+        }
         # voice channel is necessary to make "hidden" events :<
-        voice_channel = await guild.create_voice_channel(f"{channel_name}-vc", overwrites={
-            guild.default_role: discord.PermissionOverwrite(view_channel=False),
-            role: discord.PermissionOverwrite(view_channel=True)
-        })
-        self.text_channel_id = text_channel.id
-        self.voice_channel_id = voice_channel.id
+        results = await asyncio.gather(
+            guild.create_text_channel(f"{channel_name}", overwrites=overwrites, category=category),
+            guild.create_voice_channel(f"{channel_name}-vc", overwrites=overwrites, category=category),
+            owner.add_roles(role),
+            return_exceptions=True)
+        text_channel, voice_channel, _ = results
+        self.text_channel_id = text_channel.id if isinstance(text_channel, discord.abc.GuildChannel) else None
+        self.voice_channel_id = voice_channel.id if isinstance(voice_channel, discord.abc.GuildChannel) else None
         self.guild_id = guild.id
+        # Rolled back from the objects Discord returned, which a fresh guild's cache may not have yet
+        created = [role] + [channel for channel in (text_channel, voice_channel) if isinstance(channel, discord.abc.GuildChannel)]
+        failures = [result for result in results if isinstance(result, BaseException)]
+        if failures:
+            logging.warning(f"Setting up event {channel_name} in guild {guild.id} failed, rolling back")
+            await self.delete_objects(guild, created)
+            raise failures[0]
+        return created
 
     async def add_person(self, context, person: discord.Member):
         # Add role to person
         role = context.guild.get_role(self.role_id)
         await person.add_roles(role)
 
-    async def cleanup(self, context):
-        # Delete role
-        # Delete channel
-        text_channel = context.guild.get_channel(self.text_channel_id)
-        voice_channel = context.guild.get_channel(self.voice_channel_id)
-        role = context.guild.get_role(self.role_id)
-        await text_channel.delete()
-        await voice_channel.delete()
-        await role.delete()
\ No newline at end of file
+    @staticmethod
+    async def delete_objects(guild: discord.Guild, objects):
+        """Delete an event's channels and role concurrently, skipping any that are None or already gone"""
+        results = await asyncio.gather(*(obj.delete() for obj in objects if obj is not None), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, discord.NotFound):
+                logging.error(f"Failed to delete part of an event in guild {guild.id}", exc_info=result)
@@ -0,0 +1,88 @@
+import asyncio
+from dataclasses import dataclass, replace
+import discord
+
+@dataclass(frozen=True)
+class GuildSettings:
+    """A guild's room configuration as committed to storage"""
+    admin_role_id: int = None
+    room_channel_id: int = None
+
+@dataclass(frozen=True)
+class Access:
+    """What the user behind an interaction may do"""
+    # Discord Administrator permission
+    administrator: bool
+    # Manage Channels, needed to create rooms and set the room channel
+    manage_channels: bool
+    # Create Events, needed to create event channels
+    create_events: bool
+    # Holds the guild's room admin role
+    room_admin: bool
+
+class GuildSettingsCache:
+    """GuildSettings per guild, loaded from storage on first use and kept until invalidated.
+
+    Writers update the cache after their transaction commits, so a guild's settings are
+    read from storage once per process rather than once per command."""
+
+    def __init__(self, load):
+        # load(guild_id) is a coroutine returning the guild's GuildSettings from storage
+        self._load = load
+        self._settings = {}
+        self._loading = {}
+
+    async def get(self, guild_id: int) -> GuildSettings:
+        settings = self._settings.get(guild_id, None)
+        if settings is not None:
+            return settings
+        # Concurrent misses for the same guild share one load
+        loading = self._loading.get(guild_id, None)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(guild_id))
+            self._loading[guild_id] = loading
+            loading.add_done_callback(lambda future: self._loaded(guild_id, future))
+        return await loading
+
+    def _loaded(self, guild_id: int, future):
+        # Only keep the result if nothing changed the guild's settings while it loaded
+        if self._loading.get(guild_id, None) is future:
+            del self._loading[guild_id]
+            if not future.cancelled() and future.exception() is None:
+                self._settings[guild_id] = future.result()
+
+    def update(self, guild_id: int, **changes):
+        """Apply a committed change. Guilds not loaded yet pick it up when they are."""
+        self._loading.pop(guild_id, None)
+        settings = self._settings.get(guild_id, None)
+        if settings is not None:
+            self._settings[guild_id] = replace(settings, **changes)
+
+    def invalidate(self, guild_id: int = None):
+        """Drop a guild's settings, or every guild's, so they are reloaded on next use"""
+        if guild_id is None:
+            self._settings.clear()
+            self._loading.clear()
+        else:
+            self._settings.pop(guild_id, None)
+            self._loading.pop(guild_id, None)
+
+def resolve_access(interaction: discord.Interaction, settings: GuildSettings) -> Access:
+    """Resolve the interaction user's access once and remember it on the interaction.
+
+    interaction.permissions is computed by Discord for the invoking channel and arrives with
+    the interaction, and the admin role is a binary search of the member's sorted role IDs,
+    so nothing here touches storage. manage_channels is the guild-wide permission instead:
+    it guards room setup, which a channel overwrite where the command is run must not grant."""
+    access = interaction.extras.get("access", None)
+    if access is not None:
+        return access
+    permissions = interaction.permissions
+    access = Access(
+        administrator=permissions.administrator,
+        manage_channels=interaction.user.guild_permissions.manage_channels,
+        create_events=permissions.create_events,
+        room_admin=settings.admin_role_id is not None and interaction.user.get_role(settings.admin_role_id) is not None,
+    )
+    interaction.extras["access"] = access
+    return access
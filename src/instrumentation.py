@@ -0,0 +1,149 @@
+import functools
+import logging
+import time
+from contextvars import ContextVar
+import discord
+from discord.webhook.async_ import async_context
+import metrics
+
+logger = logging.getLogger('conbot')
+
+# Name of the command being handled, so storage and REST metrics can be attributed to it.
+# Background work (render queue, sweeps, startup loads) keeps the default.
+current_command = ContextVar("current_command", default="background")
+
+# Discord fails interaction callbacks after 3 seconds and follow-ups after 15 minutes
+INTERACTION_DEADLINE = 3.0
+# Unknown interaction, invalid webhook token: what Discord returns after those deadlines
+EXPIRED_INTERACTION_CODES = (10062, 50027)
+
+command_latency = metrics.histogram("command_seconds", "Time from a command reaching the bot to its handler returning",
+                                    labelnames=("command",))
+command_errors = metrics.counter("command_errors_total", "Commands that ended in an error, including ones reported to the user",
+                                 labelnames=("command", "error"))
+response_latency = metrics.histogram("interaction_response_seconds", "Time from an interaction being created to the bot's first response",
+                                     labelnames=("command",))
+deadline_misses = metrics.counter("interaction_deadline_misses_total", "Interactions answered after Discord's deadline",
+                                  labelnames=("command",))
+rest_requests = metrics.counter("discord_rest_requests_total", "Discord REST requests by originating command and endpoint",
+                                labelnames=("command", "endpoint"))
+rest_errors = metrics.counter("discord_rest_errors_total", "Discord REST requests that failed, by endpoint and HTTP status",
+                              labelnames=("endpoint", "status"))
+rest_latency = metrics.histogram("discord_rest_seconds", "Discord REST request latency, including rate limit waits",
+                                 labelnames=("endpoint",))
+
+def command_name(interaction: discord.Interaction) -> str:
+    name = interaction.command.qualified_name if interaction.command else "unknown"
+    if interaction.type is discord.InteractionType.autocomplete:
+        return f"{name}.autocomplete"
+    return name
+
+def start_command(interaction: discord.Interaction):
+    """Start timing an interaction. Called before the handler, in the task that runs it."""
+    name = command_name(interaction)
+    interaction.extras["command"] = name
+    interaction.extras["started"] = time.perf_counter()
+    current_command.set(name)
+
+def finish_command(interaction: discord.Interaction):
+    started = interaction.extras.pop("started", None)
+    if started is not None:
+        command_latency.labels(interaction.extras["command"]).observe(time.perf_counter() - started)
+
+def record_error(interaction: discord.Interaction, error: Exception):
+    command = interaction.extras.get("command", None) or command_name(interaction)
+    command_errors.labels(command, type(error).__name__).inc()
+    # ValueError and PermissionError are the user-facing ones; anything else is a bug or outage
+    if isinstance(error, (ValueError, PermissionError)):
+        logger.info(f"/{command} by {interaction.user.id} in guild {interaction.guild_id}: {error}")
+    else:
+        logger.error(f"/{command} by {interaction.user.id} in guild {interaction.guild_id} failed", exc_info=error)
+
+def instrument_rest(request):
+    """Wrap a discord.py request(route, ...) coroutine function to record per-endpoint metrics"""
+    @functools.wraps(request)
+    async def wrapper(route, *args, **kwargs):
+        endpoint = f"{route.method} {route.path}"
+        command = current_command.get()
+        rest_requests.labels(command, endpoint).inc()
+        if route.path.endswith("/callback") and route.webhook_id:
+            # Interaction callbacks carry the interaction ID, which encodes when it was created
+            response_latency.labels(command).observe(
+                (discord.utils.utcnow() - discord.utils.snowflake_time(int(route.webhook_id))).total_seconds())
+        start = time.perf_counter()
+        try:
+            return await request(route, *args, **kwargs)
+        except discord.HTTPException as e:
+            rest_errors.labels(endpoint, e.status).inc()
+            if e.code in EXPIRED_INTERACTION_CODES:
+                deadline_misses.labels(command).inc()
+            raise
+        finally:
+            rest_latency.labels(endpoint).observe(time.perf_counter() - start)
+    return wrapper
+
+def install(client: discord.Client):
+    """Record every REST request the client makes. Interaction responses and follow-ups go
+    through discord.py's webhook adapter rather than client.http, so both are wrapped."""
+    client.http.request = instrument_rest(client.http.request)
+    adapter = async_context.get()
+    adapter.request = instrument_rest(adapter.request)
+
+async def serve_metrics(host: str, port: int):
+    """Serve render_prometheus() at http://host:port/metrics until cancelled"""
+    from aiohttp import web
+    async def handle(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+def _ms(seconds: float) -> str:
+    return "∞" if seconds == float("inf") else f"{seconds * 1000:.0f}ms"
+
+def format_stats(top_endpoints: int = 8) -> str:
+    """Short human-readable summary of the metrics, for /bot_stats"""
+    lines = ["**Commands** (count, p50, p99, errors)"]
+    errors = {}
+    for labels, series in command_errors.samples():
+        errors[labels["command"]] = errors.get(labels["command"], 0) + series.value
+    for labels, series in sorted(command_latency.samples(), key=lambda sample: -sample[1].count):
+        command = labels["command"]
+        lines.append(f"`/{command}` {series.count}, {_ms(series.quantile(0.5))}, {_ms(series.quantile(0.99))}, {errors.get(command, 0)}")
+    misses = sum(series.value for _, series in deadline_misses.samples())
+    slow = [labels["command"] for labels, series in response_latency.samples() if series.quantile(0.99) > INTERACTION_DEADLINE]
+    lines.append(f"Deadline misses: {misses}" + (f" (p99 first response over 3s: {', '.join(slow)})" if slow else ""))
+
+    transactions = metrics.get("storage_transaction_seconds")
+    conflicts = metrics.get("storage_conflict_retries_total")
+    if transactions is not None:
+        lines.append("\n**Storage** (transactions, p50, p99, conflict retries)")
+        for labels, series in sorted(transactions.samples(), key=lambda sample: -sample[1].count):
+            retries = sum(child.value for child_labels, child in conflicts.samples() if child_labels == labels) if conflicts else 0
+            lines.append(f"`{labels['command']}` {series.count}, {_ms(series.quantile(0.5))}, {_ms(series.quantile(0.99))}, {retries}")
+
+    lines.append("\n**Discord REST** (requests, p99, errors)")
+    requests = {}
+    for labels, series in rest_requests.samples():
+        requests[labels["endpoint"]] = requests.get(labels["endpoint"], 0) + series.value
+    failures = {}
+    for labels, series in rest_errors.samples():
+        failures[labels["endpoint"]] = failures.get(labels["endpoint"], 0) + series.value
+    latencies = {labels["endpoint"]: series for labels, series in rest_latency.samples()}
+    for endpoint, count in sorted(requests.items(), key=lambda item: -item[1])[:top_endpoints]:
+        p99 = latencies[endpoint].quantile(0.99) if endpoint in latencies else 0.0
+        lines.append(f"`{endpoint}` {count}, {_ms(p99)}, {failures.get(endpoint, 0)}")
+
+    queue_depth = metrics.get("render_queue_depth")
+    loop_lag = metrics.get("event_loop_lag_seconds")
+    lines.append("")
+    if queue_depth is not None:
+        lines.append(f"Render queue depth: {queue_depth.value}")
+    if loop_lag is not None:
+        lines.append(f"Event loop lag p99: {_ms(loop_lag.quantile(0.99))}")
+    return "\n".join(lines)
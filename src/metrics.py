@@ -0,0 +1,141 @@
+import bisect
+import threading
+
+# Minimal in-process metrics. Metrics are created once at import time by the module
+# that owns them and looked up by name for reporting. A metric created with labelnames
+# is a family: values are recorded on its children, metric.labels(*values).inc().
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_lock = threading.Lock()
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.children = {}  # label values -> child metric
+
+    def _child(self):
+        return type(self)(self.name, self.description)
+
+    def labels(self, *values):
+        """The child metric for these label values, in labelnames order"""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values, None)
+        if child is None:
+            with _lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def samples(self):
+        """(labels dict, metric) for every series of this metric"""
+        if not self.labelnames:
+            return [({}, self)]
+        return [(dict(zip(self.labelnames, values)), child) for values, child in list(self.children.items())]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        with _lock:
+            self.value += amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+        # One count per bucket upper bound, plus the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _child(self):
+        return Histogram(self.name, self.description, self.buckets)
+
+    def observe(self, value: float):
+        with _lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the q-th quantile"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+def _register(metric):
+    with _lock:
+        existing = _registry.get(metric.name, None)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+def counter(name: str, description: str, labelnames=()) -> Counter:
+    return _register(Counter(name, description, labelnames))
+
+def gauge(name: str, description: str, labelnames=()) -> Gauge:
+    return _register(Gauge(name, description, labelnames))
+
+def histogram(name: str, description: str, buckets=DEFAULT_BUCKETS, labelnames=()) -> Histogram:
+    return _register(Histogram(name, description, buckets, labelnames))
+
+def get(name: str):
+    return _registry.get(name, None)
+
+def all_metrics():
+    return list(_registry.values())
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f"{key}=\"{value}\"" for key, value in zip(labels, escaped)) + "}"
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in all_metrics():
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, series in metric.samples():
+            if isinstance(series, Histogram):
+                cumulative = 0
+                for bound, count in zip(series.buckets + (float("inf"),), series.counts):
+                    cumulative += count
+                    lines.append(f"{metric.name}_bucket{_format_labels({**labels, 'le': _format_bound(bound)})} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {series.sum}")
+                lines.append(f"{metric.name}_count{_format_labels(labels)} {series.count}")
+            else:
+                lines.append(f"{metric.name}{_format_labels(labels)} {series.value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,72 @@
+import logging
+import discord
+
+logger = logging.getLogger('conbot')
+
+# Seconds a listing's buttons keep working after the last press
+PAGINATOR_TIMEOUT = 300
+
+class CursorPaginator(discord.ui.View):
+    """Previous/Next buttons over a listing served a page at a time.
+
+    fetch(cursor) is a coroutine returning (page text, next cursor), with cursor None for
+    the first page and next cursor None on the last. Only the cursors of pages already seen
+    are kept, so going back re-fetches a page instead of holding every page in memory."""
+
+    def __init__(self, owner_id: int, fetch, timeout: float = PAGINATOR_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.owner_id = owner_id
+        self.fetch = fetch
+        # Cursor each page seen so far started from, the current page's last
+        self.cursors = [None]
+        self.next_cursor = None
+        self.message = None
+
+    async def start(self, interaction: discord.Interaction, empty: str):
+        """Send the first page as a follow-up, with buttons only if there is a second page"""
+        text, self.next_cursor = await self.fetch(None)
+        self._update_buttons()
+        if self.next_cursor is None:
+            await interaction.followup.send(text or empty, ephemeral=True)
+            self.stop()
+        else:
+            self.message = await interaction.followup.send(text, view=self, ephemeral=True)
+
+    def _update_buttons(self):
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = self.next_cursor is None
+
+    async def _show(self, interaction: discord.Interaction):
+        text, self.next_cursor = await self.fetch(self.cursors[-1])
+        self._update_buttons()
+        await interaction.response.edit_message(content=text or "Nothing more to show.", view=self)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Listings are ephemeral, but a forwarded message shouldn't page for someone else
+        return interaction.user.id == self.owner_id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self._show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.next_cursor is not None:
+            self.cursors.append(self.next_cursor)
+        await self._show(interaction)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        try:
+            await self.message.edit(view=self)
+        except discord.HTTPException:
+            # Ephemeral messages can't be edited after their interaction token expires; harmless
+            pass
+
+    async def on_error(self, interaction: discord.Interaction, error: Exception, item):
+        logger.error(f"Paging failed for {interaction.user.id} in guild {interaction.guild_id}", exc_info=error)
+        if not interaction.response.is_done():
+            await interaction.response.send_message("Could not load that page.", ephemeral=True)
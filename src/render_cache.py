@@ -0,0 +1,56 @@
+import hashlib
+import json
+from collections import OrderedDict
+import metrics
+
+skipped_edits = metrics.counter("card_edits_skipped_total", "Card renders skipped because the visible content was unchanged")
+embed_cache_hits = metrics.counter("embed_cache_hits_total", "Card embeds reused from the embed cache instead of rebuilt")
+
+# Embed keys that change on every update without changing what the card says
+VOLATILE_KEYS = ("timestamp",)
+
+def digest(embeds) -> str:
+    """Hash of what a message's embeds show, ignoring the last-updated timestamp"""
+    content = [{key: value for key, value in embed.to_dict().items() if key not in VOLATILE_KEYS} for embed in embeds]
+    return hashlib.blake2b(json.dumps(content, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+class RenderCache:
+    """Remembers the content hash of the embeds last sent to each card message, keyed by
+    (guild_id, target) where target is the render queue key, so edits that wouldn't change
+    anything visible can be skipped. Also keeps a small LRU of built embeds keyed by room state."""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._sent = {}
+        self._embeds = OrderedDict()
+
+    def unchanged(self, guild_id: int, target: str, content_digest: str) -> bool:
+        if self._sent.get((guild_id, target), None) == content_digest:
+            skipped_edits.inc()
+            return True
+        return False
+
+    def record(self, guild_id: int, target: str, content_digest: str):
+        self._sent[(guild_id, target)] = content_digest
+
+    def invalidate(self, guild_id: int, target: str):
+        """Forget what was sent so the next render of target always edits"""
+        self._sent.pop((guild_id, target), None)
+
+    def invalidate_guild(self, guild_id: int):
+        """Forget what was sent to every card in a guild"""
+        for key in [key for key in self._sent if key[0] == guild_id]:
+            del self._sent[key]
+
+    def embed(self, state: tuple, build):
+        """The embed for a room state, built with build() on a miss"""
+        embed = self._embeds.get(state, None)
+        if embed is not None:
+            self._embeds.move_to_end(state)
+            embed_cache_hits.inc()
+            return embed
+        embed = build()
+        self._embeds[state] = embed
+        if len(self._embeds) > self.maxsize:
+            self._embeds.popitem(last=False)
+        return embed
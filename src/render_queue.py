@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import logging
+import time
+import discord
+import metrics
+from instrumentation import current_command
+
+logger = logging.getLogger('conbot')
+
+queue_depth = metrics.gauge("render_queue_depth", "Room cards waiting to be re-rendered")
+coalesced_edits = metrics.counter("render_queue_coalesced_total", "Card updates merged into an already pending render")
+card_edits = metrics.counter("card_edits_total", "Room card renders sent to Discord")
+card_edit_failures = metrics.counter("card_edit_failures_total", "Room card renders that raised")
+card_edit_latency = metrics.histogram("card_edit_seconds", "Time to render and send one room card")
+
+class ChannelBucket:
+    """Rate limit bucket for one channel. Discord allows roughly 5 requests per 5 seconds per
+    channel, counted in windows that start with a request and reset when they end. Their
+    start isn't known here, so no `per` seconds may see more than `rate` requests sent,
+    which keeps every window Discord could be counting within the limit. A bucket that
+    refilled continuously would let nearly twice the limit through one of those windows."""
+    # Seconds added to `per`, since requests take varying time to arrive and can bunch up
+    margin = 0.1
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        # Send times of the last `rate` requests
+        self.sent = collections.deque(maxlen=rate)
+        # Set when Discord tells us to back off regardless of our own accounting
+        self.blocked_until = 0.0
+        # Waiters go one at a time in arrival order, so none is starved by later ones
+        self._waiting = asyncio.Lock()
+
+    def delay(self) -> float:
+        """Seconds to wait before the next request may be sent"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if len(self.sent) < self.rate:
+            return 0.0
+        return max(0.0, self.sent[0] + self.per + self.margin - now)
+
+    def take(self):
+        self.sent.append(time.monotonic())
+
+    async def acquire(self):
+        """Wait until a request may be sent and count it against the limit"""
+        async with self._waiting:
+            delay = self.delay()
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self.delay()
+            self.take()
+
+    def back_off(self, seconds: float):
+        self.blocked_until = time.monotonic() + seconds
+        # Discord's window is over once the wait is, so earlier requests no longer count
+        self.sent.clear()
+
+class CardRenderQueue:
+    """Background queue of room card re-renders.
+
+    Updates are keyed by (guild_id, room_key). Scheduling a room that is already pending
+    only marks it dirty again, so a burst of changes results in a single edit showing the
+    latest state. Each room channel is drained by its own worker that waits debounce
+    seconds for more updates to pile up and then edits within the channel's rate limit."""
+
+    def __init__(self, render, debounce: float = 0.5, rate: int = 5, per: float = 5.0):
+        # render(guild, room_key) loads the current room state and edits its card, taking the
+        # channel's bucket itself right before it calls Discord. Returns whether it did.
+        self.render = render
+        self.debounce = debounce
+        self.rate = rate
+        self.per = per
+        self._pending = {}  # channel_id -> {(guild_id, room_key): guild}
+        self._buckets = {}  # channel_id -> ChannelBucket
+        self._workers = {}  # channel_id -> asyncio.Task
+
+    def __len__(self):
+        return sum(len(pending) for pending in self._pending.values())
+
+    def bucket(self, channel_id: int) -> ChannelBucket:
+        """The rate limit bucket for a channel, shared with anything else posting there"""
+        return self._buckets.setdefault(channel_id, ChannelBucket(self.rate, self.per))
+
+    def schedule(self, guild: discord.Guild, room_key: str, channel_id: int):
+        """Mark a room card dirty. Returns immediately; the edit happens in the background."""
+        pending = self._pending.setdefault(channel_id, {})
+        key = (guild.id, room_key)
+        if key in pending:
+            coalesced_edits.inc()
+        pending[key] = guild
+        queue_depth.set(len(self))
+        worker = self._workers.get(channel_id, None)
+        if worker is None or worker.done():
+            self._workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+
+    async def _drain(self, channel_id: int):
+        # The worker inherits the context of whichever command started it; its work is its own
+        current_command.set("render_queue")
+        pending = self._pending[channel_id]
+        bucket = self.bucket(channel_id)
+        while pending:
+            await asyncio.sleep(self.debounce)
+            while pending:
+                # Oldest first; anything scheduled while we render is picked up on the next pass
+                key = next(iter(pending))
+                guild = pending.pop(key)
+                queue_depth.set(len(self))
+                start = time.perf_counter()
+                try:
+                    # Renders that change nothing send nothing and leave the bucket alone
+                    if await self.render(guild, key[1]):
+                        card_edits.inc()
+                except discord.RateLimited as e:
+                    logger.warning(f"Rate limited editing cards in channel {channel_id}, retrying in {e.retry_after:.1f}s")
+                    bucket.back_off(e.retry_after)
+                    pending.setdefault(key, guild)
+                except Exception:
+                    card_edit_failures.inc()
+                    logger.exception(f"Failed to render room card {key[1]} in guild {key[0]}")
+                finally:
+                    card_edit_latency.observe(time.perf_counter() - start)
+        queue_depth.set(len(self))
+
+    async def join(self):
+        """Wait until every pending card has been rendered"""
+        while any(not worker.done() for worker in self._workers.values()):
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def close(self):
+        for worker in self._workers.values():
+            worker.cancel()
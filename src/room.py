@@ -1,13 +1,28 @@
 import discord
 import persistent
+from persistent.list import PersistentList
 from enum import Enum
 from dataclasses import dataclass
-import ZODB, ZODB.FileStorage
-from BTrees import OOBTree
-import os
+from BTrees import OOBTree, LOBTree
+from BTrees.Length import Length
+import asyncio
+import bisect
 import logging
+import time
 from datetime import datetime, timezone
-from utils import follow_up
+from utils import follow_up, MessageCache
+import room_index
+from render_queue import CardRenderQueue, ChannelBucket
+from storage import StorageExecutor, StorageConfig, open_db, run_startup
+from cache_sync import CacheRevisions, CACHE_SYNC_INTERVAL, bump_revision, read_revisions
+from autocomplete import RoomNameIndex, rank_names
+from room_import import format_errors
+from room_query import RoomQuery, query_rooms, PAGE_SIZE
+from change_log import ChangeLog, ChangeEntry, room_history, get_entry, HISTORY_PAGE_SIZE
+from render_cache import RenderCache, digest
+from guild_settings import GuildSettings, GuildSettingsCache, Access, resolve_access
+from board import (BOARD_SORTS, BOARD_TARGET_PREFIX, BoardChanges, board_target, relayout, attach_page, move_page,
+                   find_page, rebuild_board_index, sort_entry, changed_span)
 
 @dataclass
 class dRoomStatus:
@@ -25,131 +40,503 @@ class RoomVibe(Enum):
     CHILL = dRoomStatus("Chill", discord.Color.yellow())
     EEPY = dRoomStatus("Eepy", discord.Color.red())
 
+# Live handles for room card messages, shared by every card edit and delete
+message_cache = MessageCache()
+# What each card message currently shows, to skip edits that change nothing
+render_cache = RenderCache()
+
+STATUS_EMOJI = {
+    RoomStatus.OPEN: "🟦",  # Blue square
+    RoomStatus.ASK: "🟧",  # Orange square
+    RoomStatus.DND: "🟥",  # Red square
+}
+
+# Rooms committed per transaction by import_rooms
+IMPORT_BATCH_SIZE = 200
+# Card IDs persisted per transaction while posting imported cards
+CARD_ATTACH_BATCH_SIZE = 25
+# Seconds between status expiry sweeps
+EXPIRY_SWEEP_INTERVAL = 300
+# Rooms expired per transaction by a sweep
+EXPIRY_BATCH_SIZE = 100
+
 class ConRoomManager:
-    def __init__(self):
-        db_exists = os.path.exists("rooms.fs")
-        self.db = ZODB.DB(ZODB.FileStorage.FileStorage("rooms.fs"))
-        if not db_exists:
-            with self.db.transaction() as conn:
-                conn.root.rooms = OOBTree.BTree()
+    def __init__(self, storage_threads: int = 4, status_ttl: float = None, storage_config: StorageConfig = None):
+        self.storage_config = storage_config or StorageConfig("rooms.fs")
+        self.db = open_db(self.storage_config)
+        def create(conn):
+            # A new database, whether a new file or a new storage on a ZEO server
+            if not hasattr(conn.root, 'room_channels'):
+                conn.root.guilds = LOBTree.BTree()  # guild_id -> GuildRooms
                 conn.root.room_channels = OOBTree.BTree()
                 conn.root.admin_roles = OOBTree.BTree()  # guild_id -> role_id
+        run_startup(self.db, create)
+        def upgrade(conn):
+            self._ensure_admin_roles(conn)
+            # Existing databases keep every guild's rooms in one global tree, split them up once
+            if not hasattr(conn.root, 'guilds'):
+                self._migrate_to_guild_rooms(conn)
+            for guild_id, guild_rooms in conn.root.guilds.items():
+                if guild_rooms.location_index is None:
+                    room_index.rebuild_listing_indexes(guild_rooms)
+                    logging.info(f"Built room listing indexes for guild {guild_id}")
+                if guild_rooms.revision is None:
+                    guild_rooms.revision = Length()
+                if guild_rooms.board_index is None:
+                    rebuild_board_index(guild_rooms)
+                if guild_rooms.updated_index is not None and not isinstance(guild_rooms.updated_index, tuple):
+                    # Built as a single tree before it was sharded
+                    room_index.rebuild_updated_index(guild_rooms)
+                    logging.info(f"Rebuilt the status expiry index for guild {guild_id}")
+            return read_revisions(conn)
+        # Caches start out matching storage as of now
+        self.revisions = CacheRevisions(run_startup(self.db, upgrade))
+        # All transactions after startup run on the storage pool, off the event loop
+        self.storage = StorageExecutor(self.db, storage_threads)
+        # Who changed which room and how, written in batches off the command path
+        self.change_log = ChangeLog(self.storage, self._guild, self.revisions)
+        # Card edits are rendered in the background so commands can reply right away
+        self.render_queue = CardRenderQueue(self._render_card)
+        # Room names and memberships for autocomplete, filled by load_autocomplete
+        self.autocomplete = RoomNameIndex()
+        # Serializes board relayouts per guild so pages are posted in order
+        self._board_locks = {}
+        # Seconds a status stays current without updates before it's greyed out; None never expires
+        self.status_ttl = status_ttl
+        # Admin role and room channel per guild, so permission checks don't read storage
+        self.guild_settings = GuildSettingsCache(self._load_settings)
+
+    def close(self):
+        """Stop rendering and close storage cleanly, so the next start can reuse its index"""
+        self.render_queue.close()
+        self.storage.close()
+
+    def _migrate_to_guild_rooms(self, conn):
+        """Move rooms from the global conn.root.rooms tree into per-guild GuildRooms.
+
+        Rooms whose guild can't be worked out are kept in conn.root.unassigned_rooms, and
+        conn.root.rooms is then kept as well, so the migration never loses a room."""
+        conn.root.guilds = LOBTree.BTree()
+        rooms = getattr(conn.root, 'rooms', None) or {}
+        # Rooms created before guild_id was recorded are assigned by the channel their card is
+        # in, which only finds rooms posted since the guild last ran /set_room_channel. With a
+        # single guild there is nowhere else they can belong.
+        channel_guilds = {channel_id: guild_id for guild_id, channel_id in conn.root.room_channels.items()}
+        only_guild = next(iter(conn.root.room_channels.keys())) if len(conn.root.room_channels) == 1 else None
+        moved = 0
+        unassigned = OOBTree.BTree()
+        for room_key, room in rooms.items():
+            if room.guild_id is None:
+                room.guild_id = only_guild or channel_guilds.get(room.channel_id, None)
+            if room.guild_id is None:
+                logging.warning(f"Cannot determine guild for room {room_key}, keeping it in unassigned_rooms")
+                unassigned[room_key] = room
+                continue
+            self._guild(conn, room.guild_id, create=True).rooms[room_key] = room
+            moved += 1
+        for guild_rooms in conn.root.guilds.values():
+            room_index.rebuild_indexes(guild_rooms)
+        if unassigned:
+            conn.root.unassigned_rooms = unassigned
+        else:
+            for name in ('rooms', 'room_member_index', 'room_name_index'):
+                if hasattr(conn.root, name):
+                    delattr(conn.root, name)
+        logging.info(f"Migrated {moved} rooms into {len(conn.root.guilds)} guilds, {len(unassigned)} left unassigned")
+
+    def _guild(self, conn, guild_id: int, create: bool = False):
+        """Get a guild's rooms namespace, creating it if requested"""
+        guild_rooms = conn.root.guilds.get(guild_id, None)
+        if guild_rooms is None and create:
+            guild_rooms = GuildRooms()
+            conn.root.guilds[guild_id] = guild_rooms
+        return guild_rooms
 
     def _ensure_admin_roles(self, conn):
         """Ensure admin_roles exists in the database (for existing databases)"""
         if not hasattr(conn.root, 'admin_roles'):
             conn.root.admin_roles = OOBTree.BTree()
 
-    def has_admin_role(self, member: discord.Member, guild_id: int, conn) -> bool:
-        """Check if a member has the admin role for room management"""
-        self._ensure_admin_roles(conn)
-        admin_role_id = conn.root.admin_roles.get(guild_id, None)
-        if not admin_role_id:
-            return False
-        return any(role.id == admin_role_id for role in member.roles)
+    async def _load_settings(self, guild_id: int) -> GuildSettings:
+        def state(conn):
+            return GuildSettings(admin_role_id=conn.root.admin_roles.get(guild_id, None),
+                                 room_channel_id=conn.root.room_channels.get(guild_id, None))
+        return await self.storage.read(state)
+
+    async def access(self, interaction: discord.Interaction) -> Access:
+        """What the interaction's user may do, resolved once per interaction"""
+        return resolve_access(interaction, await self.guild_settings.get(interaction.guild.id))
 
-    def get_admin_role_id(self, guild_id: int, conn) -> int:
-        """Get the admin role ID for a guild"""
-        self._ensure_admin_roles(conn)
-        return conn.root.admin_roles.get(guild_id, None)
+    async def fetch_admin_role_id(self, guild_id: int) -> int:
+        return (await self.guild_settings.get(guild_id)).admin_role_id
 
     async def set_admin_role(self, interaction: discord.Interaction, role: discord.Role):
         """Set the admin role for room management (requires Administrator permission)"""
-        if not interaction.user.guild_permissions.administrator:
+        if not (await self.access(interaction)).administrator:
             raise PermissionError("You must have Administrator permission to set the admin role.")
-        with self.db.transaction() as conn:
-            self._ensure_admin_roles(conn)
+        def state(conn):
             conn.root.admin_roles[interaction.guild.id] = role.id
+            bump_revision(self._guild(conn, interaction.guild.id, create=True))
+        async with self.revisions.lock:
+            await self.storage.write(state)
+            self.revisions.local_change(interaction.guild.id)
+        self.guild_settings.update(interaction.guild.id, admin_role_id=role.id)
 
     async def set_room_channel(self, requestor: discord.Member, interaction: discord.Interaction):
-        if all([role.permissions.manage_channels == False for role in requestor.roles]):
+        if not (await self.access(interaction)).manage_channels:
             raise PermissionError("You do not have permission to set room channels.")
-        with self.db.transaction() as conn:
+        def state(conn):
             conn.root.room_channels[interaction.guild.id] = interaction.channel.id
+            bump_revision(self._guild(conn, interaction.guild.id, create=True))
+        async with self.revisions.lock:
+            await self.storage.write(state)
+            self.revisions.local_change(interaction.guild.id)
+        self.guild_settings.update(interaction.guild.id, room_channel_id=interaction.channel.id)
    
     async def create_room(self, interaction: discord.Interaction, requestor: discord.Member, hotel: str, room_number: int, room_name: str = None):
-        if all([role.permissions.manage_channels == False for role in requestor.roles]):
+        if not (await self.access(interaction)).manage_channels:
             raise PermissionError("You do not have permission to create rooms.")
         room_key = f"{hotel}-{room_number}"
-        with self.db.transaction() as conn:
-            if room_key in conn.root.rooms:
+        # Reserve the room key first so concurrent creates of the same room conflict here
+        # rather than both posting a card
+        def reserve(conn):
+            guild_rooms = self._guild(conn, interaction.guild.id, create=True)
+            if room_key in guild_rooms.rooms:
                 raise ValueError("Room already exists.")
             room_channel = conn.root.room_channels.get(interaction.guild.id, None)
             if not room_channel:
                 raise ValueError("No room channel set for this server. Please set a room channel first.")
-            await follow_up(interaction, f"Creating room {hotel} {room_number}...", ephemeral=True)
-            room_channel_obj = interaction.guild.get_channel(room_channel)
+            room = Room(requestor, hotel, room_number, None, room_name)
+            guild_rooms.rooms[room_key] = room
+            room_index.index_room(guild_rooms, room, room_key)
+            mode = guild_rooms.board_mode
+            board_changes = self._relayout_in(conn, interaction.guild.id, changed_span(mode, sort_entry(mode, room, room_key)))
+            return room_channel, RoomCard.from_room(room), board_changes
+        room_channel, card, board_changes = await self.storage.write(reserve)
+        self.autocomplete.set_room(interaction.guild.id, room_key, card.room_name, card.members)
+        await follow_up(interaction, f"Creating room {hotel} {room_number}...", ephemeral=True)
 
-            # Create temporary room to generate embed
-            temp_room = Room(requestor, hotel, room_number, None, room_name)
-            embed = await temp_room.create_embed(interaction.guild)
-            message = await room_channel_obj.send(embed=embed)
+        if board_changes:
+            # The room got a slot on the board instead of its own message
+            await self._apply_board_changes(interaction.guild, board_changes)
+            self._log(interaction.guild.id, card, requestor.id, "create")
+            await follow_up(interaction, f"Room {hotel} {room_number} created successfully.", ephemeral=True)
+            return
 
-            # Now create the actual room with the message
-            room = Room(requestor, hotel, room_number, message, room_name)
+        try:
+            room_channel_obj = interaction.guild.get_channel(room_channel)
+            embed = card.create_embed(interaction.guild)
+            # Shares the channel's rate limit with card edits
+            await self.render_queue.bucket(room_channel).acquire()
+            message = await room_channel_obj.send(embed=embed)
+            render_cache.record(interaction.guild.id, room_key, digest([embed]))
+        except Exception:
+            # Posting the card failed, release the reserved key
+            def release(conn):
+                self._delete_room(conn, interaction.guild.id, room_key)
+            await self.storage.write(release)
+            self.autocomplete.remove_room(interaction.guild.id, room_key)
+            raise
 
-            conn.root.rooms[room_key] = room
+        def attach(conn):
+            guild_rooms = self._guild(conn, interaction.guild.id)
+            room = guild_rooms.rooms.get(room_key, None)
+            # The room may have been removed, or removed and created again, while the card was posting
+            if room and not room.message_id:
+                room.message_id = message.id
+                room.channel_id = message.channel.id
+                room_index.index_message(guild_rooms, room, room_key)
+                return True
+            return False
+        if not await self.storage.write(attach):
+            await self.render_queue.bucket(room_channel).acquire()
+            await message.delete()
+            raise ValueError(f"Room {hotel} {room_number} was removed while its card was being posted.")
+        self._log(interaction.guild.id, card, requestor.id, "create")
         await follow_up(interaction, f"Room {hotel} {room_number} created successfully.", ephemeral=True)
     
+    async def import_rooms(self, interaction: discord.Interaction, requestor: discord.Member, rows, progress=None):
+        """Create many rooms from validated ImportRows, then post their cards.
+
+        progress is an optional coroutine function called with a status line as work advances."""
+        if not (await self.access(interaction)).manage_channels:
+            raise PermissionError("You do not have permission to import rooms.")
+        guild = interaction.guild
+        def check(conn):
+            if not conn.root.room_channels.get(guild.id, None):
+                raise ValueError("No room channel set for this server. Please set a room channel first.")
+            guild_rooms = self._guild(conn, guild.id)
+            return [row for row in rows if guild_rooms is not None and row.key in guild_rooms.rooms]
+        existing = await self.storage.read(check)
+        if existing:
+            raise ValueError(format_errors([f"Room {row.hotel} {row.room_number} already exists." for row in existing]))
+
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            batch = rows[start:start + IMPORT_BATCH_SIZE]
+            def state(conn):
+                guild_rooms = self._guild(conn, guild.id, create=True)
+                cards = []
+                for row in batch:
+                    if row.key in guild_rooms.rooms:
+                        raise ValueError(f"Room {row.hotel} {row.room_number} already exists.")
+                    room = Room(requestor, row.hotel, row.room_number, None, row.room_name)
+                    room.members = tuple(sorted(set(row.member_ids)))
+                    guild_rooms.rooms[row.key] = room
+                    room_index.index_room(guild_rooms, room, row.key)
+                    cards.append(RoomCard.from_room(room))
+                return cards
+            for card in await self.storage.write(state):
+                self.autocomplete.set_room(guild.id, card.key, card.room_name, card.members)
+                self._log(guild.id, card, requestor.id, "import")
+            if progress:
+                await progress(f"Created {start + len(batch)}/{len(rows)} rooms...")
+
+        return await self.post_missing_cards(guild, [row.key for row in rows], progress)
+
+    async def post_missing_cards(self, guild: discord.Guild, room_keys, progress=None) -> int:
+        """Post cards for the given rooms that don't have one yet, paced by the room channel's
+        rate limit bucket. Returns the number of messages posted."""
+        def snapshot(conn):
+            guild_rooms = self._guild(conn, guild.id)
+            if guild_rooms is not None and guild_rooms.board_mode:
+                return None, None
+            rooms = [guild_rooms.rooms.get(room_key, None) for room_key in room_keys] if guild_rooms else []
+            return conn.root.room_channels.get(guild.id, None), [RoomCard.from_room(room) for room in rooms if room and not room.message_id]
+        channel_id, cards = await self.storage.read(snapshot)
+        if cards is None:
+            # Board mode: missing rooms are placed by a relayout, which posts only new pages
+            return await self._relayout_board(guild)
+        channel = guild.get_channel(channel_id) if channel_id else None
+        if channel is None:
+            raise ValueError("Room channel not found. Please set a room channel first.")
+        bucket = self.render_queue.bucket(channel.id)
+
+        posted = {}
+        async def attach():
+            def state(conn):
+                guild_rooms = self._guild(conn, guild.id)
+                unattached = []
+                for room_key, message in posted.items():
+                    room = guild_rooms.rooms.get(room_key, None) if guild_rooms else None
+                    if room and not room.message_id:
+                        room.message_id = message.id
+                        room.channel_id = channel.id
+                        room_index.index_message(guild_rooms, room, room_key)
+                    else:
+                        unattached.append(message)
+                return unattached
+            unattached = await self.storage.write(state)
+            posted.clear()
+            # Rooms removed or given a card elsewhere while posting must not keep a stray message
+            for message in unattached:
+                await bucket.acquire()
+                await message.delete()
+            return len(unattached)
+
+        count = 0
+        try:
+            for card in cards:
+                await bucket.acquire()
+                embed = card.create_embed(guild)
+                message = await channel.send(embed=embed)
+                render_cache.record(guild.id, card.key, digest([embed]))
+                posted[card.key] = message
+                count += 1
+                if len(posted) >= CARD_ATTACH_BATCH_SIZE:
+                    count -= await attach()
+                    if progress:
+                        await progress(f"Posted {count}/{len(cards)} room cards...")
+        finally:
+            # Persist whatever was posted even if a send failed, so a retry only posts the rest
+            if posted:
+                count -= await attach()
+        return count
+
     def get_person_room(self, conn, person: discord.Member, room_name: str = None, hotel: str = None, room_number: int = None, require_membership: bool = True):
+        guild_rooms = self._guild(conn, person.guild.id)
+        if guild_rooms is None:
+            return None
+        member_keys = room_index.member_room_keys(guild_rooms, person.id)
         # Search by room name if provided
         if room_name:
-            if require_membership:
-                rooms = [room for room in conn.root.rooms.values() if room.room_name == room_name and room.person_in_room(person)]
-            else:
-                rooms = [room for room in conn.root.rooms.values() if room.room_name == room_name]
-            if len(rooms) > 0:
-                return rooms[0]
+            for room_key in room_index.name_room_keys(guild_rooms, room_name):
+                if not require_membership or room_key in member_keys:
+                    return guild_rooms.rooms.get(room_key, None)
             return None
         # Search by hotel and room number if provided
         if hotel and room_number:
             room_key = f"{hotel}-{room_number}"
-            room = conn.root.rooms.get(room_key, None)
+            room = guild_rooms.rooms.get(room_key, None)
             if room and (not require_membership or room.person_in_room(person)):
                 return room
             return None
         # Otherwise find any room where person is a member
         if require_membership:
-            rooms = [room for room in conn.root.rooms.values() if room.person_in_room(person)]
-            if len(rooms) == 0:
-                return None
-            return rooms[0]
+            for room_key in member_keys:
+                return guild_rooms.rooms.get(room_key, None)
         return None
+
+    def get_member_rooms(self, conn, person: discord.Member):
+        """Rooms in the person's guild that they are a member of"""
+        guild_rooms = self._guild(conn, person.guild.id)
+        keys = room_index.member_room_keys(guild_rooms, person.id)
+        return [guild_rooms.rooms[room_key] for room_key in keys if room_key in guild_rooms.rooms]
+
+    async def fetch_member_room_names(self, person: discord.Member):
+        """Names of the named rooms the person is a member of"""
+        return await self.storage.read(lambda conn: [room.room_name for room in self.get_member_rooms(conn, person) if room.room_name])
+
+    async def autocomplete_room_names(self, person: discord.Member, current: str):
+        """Up to 25 names of the person's rooms matching current, served from memory once loaded"""
+        if self.autocomplete.is_loaded(person.guild.id):
+            return self.autocomplete.search(person.guild.id, person.id, current)
+        return rank_names(await self.fetch_member_room_names(person), current)
+
+    async def list_rooms(self, guild_id: int, cursor=None, hotel: str = None, status: RoomStatus = None, vibe: RoomVibe = None,
+                         member_id: int = None, name: str = None, limit: int = PAGE_SIZE):
+        """One page of the guild's rooms matching every given filter, in hotel and room number
+        order (room key order for member and name searches). Returns (RoomCards, next cursor)."""
+        query = RoomQuery(hotel=hotel.strip() if hotel else None,
+                          status=ROOM_STATUSES.index(status) if status else None,
+                          vibe=ROOM_VIBES.index(vibe) if vibe else None,
+                          member_id=member_id, name=name)
+        def state(conn):
+            guild_rooms = self._guild(conn, guild_id)
+            if guild_rooms is None:
+                return [], None
+            rooms, next_cursor = query_rooms(guild_rooms, query, cursor, limit)
+            return [RoomCard.from_room(room) for room in rooms], next_cursor
+        return await self.storage.read(state)
+
+    async def load_autocomplete(self, client: discord.Client = None):
+        """Load the room names of every guild the client serves into the autocomplete index, one
+        guild per transaction. Without a client, every guild in storage is loaded."""
+        if client is not None:
+            # Guilds are only known once every shard has connected
+            await client.wait_until_ready()
+        guild_ids = await self.storage.read(lambda conn: list(conn.root.guilds.keys()))
+        if client is not None:
+            # Guilds on shards other processes run never get a lookup here
+            guild_ids = [guild_id for guild_id in guild_ids if client.get_guild(guild_id) is not None]
+        for guild_id in guild_ids:
+            await self._load_autocomplete_guild(guild_id)
+        logging.info(f"Loaded room autocomplete for {len(guild_ids)} guilds")
+
+    async def _load_autocomplete_guild(self, guild_id: int):
+        self.autocomplete.begin_load(guild_id)
+        def snapshot(conn):
+            guild_rooms = self._guild(conn, guild_id)
+            if guild_rooms is None:
+                return []
+            return [(room_key, room.room_name, tuple(room.members)) for room_key, room in guild_rooms.rooms.items()]
+        self.autocomplete.finish_load(guild_id, await self.storage.read(snapshot))
+
+    def _invalidate_guild(self, client: discord.Client, guild_id: int):
+        """Drop everything cached about a guild another process changed"""
+        if client.get_guild(guild_id) is None:
+            # Served by another process, nothing is cached for it here
+            return
+        self.guild_settings.invalidate(guild_id)
+        render_cache.invalidate_guild(guild_id)
+        if self.autocomplete.is_loaded(guild_id):
+            # Lookups read storage until the reload finishes
+            self.autocomplete.invalidate(guild_id)
+            asyncio.create_task(self._load_autocomplete_guild(guild_id))
+
+    async def run_cache_sync(self, client: discord.Client, interval: float = CACHE_SYNC_INTERVAL):
+        """When storage is shared with other processes, check every interval seconds for guilds
+        they changed and drop this process's caches for the ones the client serves"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with self.revisions.lock:
+                    changed = self.revisions.changed_elsewhere(await self.storage.read(read_revisions))
+                for guild_id in changed:
+                    self._invalidate_guild(client, guild_id)
+                if changed:
+                    logging.info(f"Dropped cached state for {len(changed)} guilds changed by other processes")
+            except Exception:
+                logging.exception("Checking for changes from other processes failed")
+
+    def _get_room(self, conn, guild_id: int, room_key: str):
+        guild_rooms = self._guild(conn, guild_id)
+        if guild_rooms is None:
+            return None
+        return guild_rooms.rooms.get(room_key, None)
+
+    def _delete_room(self, conn, guild_id: int, room_key: str):
+        guild_rooms = self._guild(conn, guild_id)
+        room = guild_rooms.rooms.get(room_key, None) if guild_rooms else None
+        if room:
+            room_index.unindex_room(guild_rooms, room, room_key)
+            del guild_rooms.rooms[room_key]
+        return room
     
     async def add_person_to_room(self, person: discord.Member, interaction: discord.Interaction, hotel: str = None, room_number: int = None):
-        with self.db.transaction() as conn:
-            is_admin = self.has_admin_role(interaction.user, interaction.guild.id, conn)
+        is_admin = (await self.access(interaction)).room_admin
+        def state(conn):
             # Admins can add people to any room, regular users need membership
             room = self.get_person_room(conn, interaction.user, None, hotel, room_number, require_membership=not is_admin)
             if not room:
                 raise ValueError("No valid room found.")
-            await room.add_person(interaction, person, is_admin)
-            await follow_up(interaction, f"{person.name} added to room {room.hotel} {room.room_number} successfully.", ephemeral=True)
+            guild_rooms = self._guild(conn, room.guild_id)
+            room_index.unindex_updated(guild_rooms, room, room.key)
+            room.add_person(interaction.user, person, is_admin)
+            room_index.index_member(guild_rooms, person.id, room.key)
+            room_index.index_updated(guild_rooms, room, room.key)
+            return RoomCard.from_room(room)
+        card = await self.storage.write(state)
+        self._log(interaction.guild.id, card, interaction.user.id, "add_member", person.id)
+        self.autocomplete.set_room(interaction.guild.id, card.key, card.room_name, card.members)
+        self._schedule_card(interaction.guild, card)
+        await follow_up(interaction, f"{person.name} added to room {card.hotel} {card.room_number} successfully.", ephemeral=True)
    
     async def update_room_status(self, interaction: discord.Interaction, status: RoomStatus, vibe: RoomVibe, room_name: str = None, hotel: str = None, room_number: int = None):
-        with self.db.transaction() as conn:
-            is_admin = self.has_admin_role(interaction.user, interaction.guild.id, conn)
+        is_admin = (await self.access(interaction)).room_admin
+        def state(conn):
             # Admins can access any room, regular users need membership
             room = self.get_person_room(conn, interaction.user, room_name, hotel, room_number, require_membership=not is_admin)
             if not room:
                 raise PermissionError("You do not belong to a room.")
-            await room.update_status(interaction, interaction.user, status, vibe, is_admin)
-            await follow_up(interaction, f"Room status updated to {status.value.name} and vibe to {vibe.value.name}.", ephemeral=True)
+            guild_rooms = self._guild(conn, room.guild_id)
+            old_entry = sort_entry("status", room, room.key)
+            room_index.unindex_updated(guild_rooms, room, room.key)
+            room_index.unindex_status(guild_rooms, room, room.key)
+            room.update_status(interaction.user, status, vibe, is_admin)
+            room_index.index_updated(guild_rooms, room, room.key)
+            room_index.index_status(guild_rooms, room, room.key)
+            # Only a board sorted by status can move the room
+            mode = guild_rooms.board_mode if guild_rooms.board_mode == "status" else None
+            board_changes = self._relayout_in(conn, room.guild_id, changed_span(mode, old_entry, sort_entry("status", room, room.key)))
+            return RoomCard.from_room(room), board_changes
+        card, board_changes = await self.storage.write(state)
+        self._log(interaction.guild.id, card, interaction.user.id, "status")
+        if board_changes:
+            # The room may have moved to another page
+            await self._apply_board_changes(interaction.guild, board_changes)
+        self._schedule_card(interaction.guild, card)
+        await follow_up(interaction, f"Room status updated to {status.value.name} and vibe to {vibe.value.name}.", ephemeral=True)
 
     async def update_room_info(self, interaction: discord.Interaction, old_hotel: str, old_room_number: int, new_hotel: str = None, new_room_number: int = None, new_room_name: str = None):
         """Update room information (admin only)"""
-        with self.db.transaction() as conn:
-            # Check admin permission
-            if not self.has_admin_role(interaction.user, interaction.guild.id, conn):
-                raise PermissionError("You must have the admin role to update room information.")
+        if not (await self.access(interaction)).room_admin:
+            raise PermissionError("You must have the admin role to update room information.")
+        def state(conn):
 
             # Get the room
+            guild_rooms = self._guild(conn, interaction.guild.id)
             old_room_key = f"{old_hotel}-{old_room_number}"
-            room = conn.root.rooms.get(old_room_key, None)
+            room = guild_rooms.rooms.get(old_room_key, None) if guild_rooms else None
             if not room:
                 raise ValueError("Room does not exist.")
+            new_room_key = f"{new_hotel if new_hotel is not None else room.hotel}-{new_room_number if new_room_number is not None else room.room_number}"
+            if new_room_key != old_room_key and new_room_key in guild_rooms.rooms:
+                raise ValueError("Room already exists.")
 
             # Update room properties
+            mode = guild_rooms.board_mode
+            old_entry = sort_entry(mode, room, old_room_key)
+            room_index.unindex_room(guild_rooms, room, old_room_key)
             if new_hotel is not None:
                 room.hotel = new_hotel
             if new_room_number is not None:
@@ -160,85 +547,492 @@ class ConRoomManager:
             room.last_updated = datetime.now(timezone.utc)
 
             # If hotel or room number changed, update the key in the database
-            new_room_key = f"{room.hotel}-{room.room_number}"
             if old_room_key != new_room_key:
-                del conn.root.rooms[old_room_key]
-                conn.root.rooms[new_room_key] = room
+                del guild_rooms.rooms[old_room_key]
+                guild_rooms.rooms[new_room_key] = room
+            room_index.index_room(guild_rooms, room, new_room_key)
+            board_changes = self._relayout_in(conn, interaction.guild.id, changed_span(mode, old_entry, sort_entry(mode, room, new_room_key)))
+            return RoomCard.from_room(room), board_changes
 
-            # Update the room card
-            channel = interaction.guild.get_channel(room.channel_id)
-            message = await channel.fetch_message(room.message_id)
-            embed = await room.create_embed(interaction.guild)
-            await message.edit(embed=embed)
+        # Update the room card
+        card, board_changes = await self.storage.write(state)
+        old_room_key = f"{old_hotel}-{old_room_number}"
+        if card.key != old_room_key:
+            # Leave a pointer in the old key's history to where the room went
+            self.change_log.record(interaction.guild.id, old_room_key, interaction.user.id, "move", None, card.key)
+        self._log(interaction.guild.id, card, interaction.user.id, "edit", old_room_key if card.key != old_room_key else None)
+        self.autocomplete.remove_room(interaction.guild.id, old_room_key)
+        self.autocomplete.set_room(interaction.guild.id, card.key, card.room_name, card.members)
+        if board_changes:
+            # A new hotel or room number can move the room to another page
+            await self._apply_board_changes(interaction.guild, board_changes)
+        self._schedule_card(interaction.guild, card)
+
+    async def expire_statuses(self, guild: discord.Guild) -> int:
+        """Grey out rooms whose status hasn't been updated within status_ttl and queue their
+        cards. Walks the guild's updated_index from the oldest entry, so only expired rooms are
+        read. Returns the number of rooms expired."""
+        cutoff = int(time.time() - self.status_ttl)
+        def state(conn):
+            guild_rooms = self._guild(conn, guild.id)
+            if guild_rooms is None:
+                return []
+            if guild_rooms.updated_index is None:
+                room_index.rebuild_updated_index(guild_rooms)
+            cards = []
+            for room_key in room_index.expired_room_keys(guild_rooms, cutoff, EXPIRY_BATCH_SIZE):
+                room = guild_rooms.rooms[room_key]
+                room_index.unindex_updated(guild_rooms, room, room_key)
+                room.stale = True
+                cards.append(RoomCard.from_room(room))
+            return cards
+        expired = 0
+        while True:
+            # One transaction per batch so a big backlog doesn't hold up other writes
+            cards = await self.storage.write(state)
+            for card in cards:
+                self._log(guild.id, card, None, "expire")
+                # The render queue paces these within each channel's rate limit, and
+                # board pages with several expired rooms are only edited once
+                self._schedule_card(guild, card)
+            expired += len(cards)
+            if len(cards) < EXPIRY_BATCH_SIZE:
+                return expired
+
+    async def run_expiry_sweeper(self, client: discord.Client):
+        """Expire stale statuses in every guild the client is in, every EXPIRY_SWEEP_INTERVAL seconds"""
+        if not self.status_ttl:
+            return
+        while True:
+            guild_ids = await self.storage.read(lambda conn: list(conn.root.guilds.keys()))
+            for guild_id in guild_ids:
+                guild = client.get_guild(guild_id)
+                if guild is None:
+                    continue
+                try:
+                    expired = await self.expire_statuses(guild)
+                    if expired:
+                        logging.info(f"Expired {expired} room statuses in guild {guild_id}")
+                except Exception:
+                    logging.exception(f"Status expiry sweep failed in guild {guild_id}")
+            await asyncio.sleep(EXPIRY_SWEEP_INTERVAL)
+
+    async def remove_departed_member(self, guild: discord.Guild, member_id: int) -> int:
+        """Take a member who left the guild out of every room they were in and queue those
+        cards. Rooms are found through the member index. Returns the number of rooms changed."""
+        def state(conn):
+            guild_rooms = self._guild(conn, guild.id)
+            cards = []
+            for room_key in list(room_index.member_room_keys(guild_rooms, member_id)):
+                room = guild_rooms.rooms.get(room_key, None)
+                room_index.unindex_member(guild_rooms, member_id, room_key)
+                if room is None:
+                    continue
+                room.remove_member(member_id)
+                cards.append(RoomCard.from_room(room))
+            return cards
+        cards = await self.storage.write(state)
+        for card in cards:
+            self._log(guild.id, card, None, "member_left", member_id)
+            self.autocomplete.set_room(guild.id, card.key, card.room_name, card.members)
+            # Rooms sharing a board page are merged into one edit by the render queue
+            self._schedule_card(guild, card)
+        return len(cards)
+
+    async def handle_messages_deleted(self, guild: discord.Guild, channel_id: int, message_ids):
+        """Recreate room cards and board pages among deleted messages that were deleted by
+        someone other than the bot. The bot's own deletes unindex the message first, so they
+        are ignored here. Deletes outside the room channel return without reading storage."""
+        if channel_id != (await self.guild_settings.get(guild.id)).room_channel_id:
+            return
+        def find(conn, build: bool = False):
+            guild_rooms = self._guild(conn, guild.id)
+            if guild_rooms is None:
+                return [], []
+            if guild_rooms.message_index is None and not build:
+                return None, None
+            cards, board_pages = [], []
+            for message_id in message_ids:
+                room_key = room_index.message_room_key(guild_rooms, message_id)
+                if room_key is not None:
+                    cards.append(RoomCard.from_room(guild_rooms.rooms[room_key]))
+                elif find_page(guild_rooms, message_id) is not None:
+                    board_pages.append(message_id)
+            return cards, board_pages
+        cards, board_pages = await self.storage.read(find)
+        if cards is None:
+            # Guilds from before the message index get it built here, which takes a write
+            cards, board_pages = await self.storage.write(lambda conn: find(conn, build=True))
+        for message_id in message_ids:
+            message_cache.discard(channel_id, message_id)
+        for card in cards:
+            logging.info(f"Card for room {card.key} in guild {guild.id} was deleted, recreating it")
+            render_cache.invalidate(guild.id, card.key)
+            await self._recreate_card(guild, card)
+        for message_id in board_pages:
+            # The page render finds the message gone and reposts it
+            render_cache.invalidate(guild.id, board_target(message_id))
+            self.render_queue.schedule(guild, board_target(message_id), channel_id)
+
+    async def invalidate_member_cards(self, guild_id: int, member_id: int):
+        """Force the next render of every card showing a member, e.g. after they leave or are renamed"""
+        def state(conn):
+            guild_rooms = self._guild(conn, guild_id)
+            rooms = [guild_rooms.rooms.get(room_key, None) for room_key in room_index.member_room_keys(guild_rooms, member_id)]
+            return [RoomCard.from_room(room) for room in rooms if room]
+        for card in await self.storage.read(state):
+            render_cache.invalidate(guild_id, card.key if card.board_slot is None else board_target(card.message_id))
+
+    def _log(self, guild_id: int, card: "RoomCard", actor_id: int, action: str, detail=None):
+        """Record a committed change to the room card was taken from"""
+        self.change_log.record(guild_id, card.key, actor_id, action, card.logged_state(), detail)
+
+    def _schedule_card(self, guild: discord.Guild, card: "RoomCard"):
+        """Queue a re-render of whatever message shows the room: its own card or its board page"""
+        if card.message_id is None:
+            # Not posted yet; it is rendered with its latest state when it is
+            return
+        target = card.key if card.board_slot is None else board_target(card.message_id)
+        self.render_queue.schedule(guild, target, card.channel_id)
+
+    async def _render_card(self, guild: discord.Guild, room_key: str) -> bool:
+        """Render the current state of a room onto its card. Called by the render queue.
+        Returns whether anything was sent to Discord."""
+        if room_key.startswith(BOARD_TARGET_PREFIX):
+            return await self._render_board_page(guild, int(room_key[len(BOARD_TARGET_PREFIX):]))
+        def state(conn):
+            room = self._get_room(conn, guild.id, room_key)
+            # Rooms on a board are rendered with the rest of their page
+            if not room or not room.message_id or room.board_slot is not None:
+                return None
+            return RoomCard.from_room(room)
+        card = await self.storage.read(state)
+        if not card:
+            return False
+        edited = await card.edit(guild, self.render_queue.bucket(card.channel_id))
+        if edited is False:
+            # The card was deleted out from under us, post a fresh one
+            logging.warning(f"Card for room {room_key} in guild {guild.id} is missing, recreating it")
+            await self._recreate_card(guild, card)
+            return True
+        return bool(edited)
+
+    async def _recreate_card(self, guild: discord.Guild, card: "RoomCard"):
+        """Post a new card for a room whose message is gone and persist its new IDs"""
+        message_cache.discard(card.channel_id, card.message_id)
+        channel = guild.get_channel(card.channel_id)
+        if channel is None:
+            room_channel = (await self.guild_settings.get(guild.id)).room_channel_id
+            channel = guild.get_channel(room_channel) if room_channel else None
+            if channel is None:
+                raise ValueError(f"No room channel available to recreate the card for room {card.key}.")
+        embed = card.create_embed(guild)
+        bucket = self.render_queue.bucket(channel.id)
+        await bucket.acquire()
+        message = await channel.send(embed=embed)
+        render_cache.record(guild.id, card.key, digest([embed]))
+        def attach(conn):
+            guild_rooms = self._guild(conn, guild.id)
+            room = guild_rooms.rooms.get(card.key, None) if guild_rooms else None
+            # Only claim the room if nobody recreated or moved its card in the meantime
+            if room and room.message_id == card.message_id:
+                room_index.unindex_message(guild_rooms, room, card.key)
+                room.message_id = message.id
+                room.channel_id = message.channel.id
+                room_index.index_message(guild_rooms, room, card.key)
+                return True
+            return False
+        if not await self.storage.write(attach):
+            await bucket.acquire()
+            await message.delete()
+
+    async def _render_board_page(self, guild: discord.Guild, message_id: int) -> bool:
+        """Render every room on a board page into its message. Returns whether anything was
+        sent to Discord."""
+        def state(conn):
+            guild_rooms = self._guild(conn, guild.id)
+            page = find_page(guild_rooms, message_id)
+            if page is None:
+                return None, None
+            rooms = [guild_rooms.rooms.get(room_key, None) for room_key in page.room_keys]
+            return page.channel_id, [RoomCard.from_room(room) for room in rooms if room]
+        channel_id, cards = await self.storage.read(state)
+        if not cards:
+            return False
+        embeds = [card.create_embed(guild) for card in cards]
+        target = board_target(message_id)
+        content = digest(embeds)
+        if render_cache.unchanged(guild.id, target, content):
+            return False
+        message = message_cache.get(guild, channel_id, message_id)
+        try:
+            if message is not None:
+                await self.render_queue.bucket(channel_id).acquire()
+                await message.edit(embeds=embeds)
+                render_cache.record(guild.id, target, content)
+                return True
+        except discord.NotFound:
+            pass
+        render_cache.invalidate(guild.id, target)
+        # The page was deleted out from under us, post it again
+        logging.warning(f"Board message {message_id} in guild {guild.id} is missing, recreating it")
+        message_cache.discard(channel_id, message_id)
+        room_channel = (await self.guild_settings.get(guild.id)).room_channel_id
+        channel = guild.get_channel(room_channel) if room_channel else None
+        if channel is None:
+            raise ValueError("No room channel available to recreate the room board.")
+        bucket = self.render_queue.bucket(channel.id)
+        await bucket.acquire()
+        new_message = await channel.send(embeds=embeds)
+        render_cache.record(guild.id, board_target(new_message.id), content)
+        def attach(conn):
+            guild_rooms = self._guild(conn, guild.id)
+            page = find_page(guild_rooms, message_id)
+            if page is None:
+                return False
+            move_page(guild_rooms, page, new_message.id, channel.id)
+            return True
+        if not await self.storage.write(attach):
+            await bucket.acquire()
+            await new_message.delete()
+        return True
+
+    def _relayout_in(self, conn, guild_id: int, changed: tuple) -> BoardChanges:
+        """Lay the guild's board out again for a change made in this transaction, so the board
+        always commits together with the rooms it shows. changed is the change's changed_span;
+        returns None when it is None, i.e. the change can't move a room on a board."""
+        if changed is None:
+            return None
+        return relayout(self._guild(conn, guild_id), conn.root.room_channels.get(guild_id, None), changed)
+
+    async def _relayout_board(self, guild: discord.Guild) -> int:
+        """Re-sort every room of a board-mode guild into pages and apply the changes, for when
+        no single change says where to look. Returns the number of pages posted."""
+        def state(conn):
+            guild_rooms = self._guild(conn, guild.id)
+            if guild_rooms is None or not guild_rooms.board_mode:
+                return None
+            return relayout(guild_rooms, conn.root.room_channels.get(guild.id, None))
+        changes = await self.storage.write(state)
+        return await self._apply_board_changes(guild, changes) if changes else 0
+
+    async def _apply_board_changes(self, guild: discord.Guild, changes: BoardChanges) -> int:
+        """Re-render the board pages a committed relayout changed, post its new pages and
+        delete emptied ones. Returns the number of pages posted."""
+        channel_id = changes.channel_id
+        for message_id in changes.changed_message_ids:
+            self.render_queue.schedule(guild, board_target(message_id), channel_id)
+        channel = guild.get_channel(channel_id) if channel_id else None
+        if changes.new_pages and channel is None:
+            raise ValueError("Room channel not found. Please set a room channel first.")
+        bucket = self.render_queue.bucket(channel_id)
+        posted = 0
+        for index in changes.new_pages:
+            # One page is posted at a time per guild, so two changes never post the same page
+            async with self._board_locks.setdefault(guild.id, asyncio.Lock()):
+                def pending(conn):
+                    # Later changes may have posted, changed or dropped the page since
+                    guild_rooms = self._guild(conn, guild.id)
+                    board = guild_rooms.board if guild_rooms else ()
+                    if index >= len(board) or board[index].message_id:
+                        return None, None
+                    rooms = [guild_rooms.rooms.get(room_key, None) for room_key in board[index].room_keys]
+                    return board[index].room_keys, [RoomCard.from_room(room) for room in rooms if room]
+                room_keys, cards = await self.storage.read(pending)
+                if not cards:
+                    continue
+                await bucket.acquire()
+                embeds = [card.create_embed(guild) for card in cards]
+                message = await channel.send(embeds=embeds)
+                render_cache.record(guild.id, board_target(message.id), digest(embeds))
+                attached, stale = await self.storage.write(
+                    lambda conn: attach_page(self._guild(conn, guild.id), index, message.id, channel.id, room_keys))
+                if not attached:
+                    await bucket.acquire()
+                    await message.delete()
+                    continue
+                posted += 1
+                if stale:
+                    self.render_queue.schedule(guild, board_target(message.id), channel.id)
+
+        for message_id in changes.removed_message_ids:
+            await bucket.acquire()
+            await delete_message(guild, channel_id, message_id)
+        return posted
+
+    async def set_board_mode(self, interaction: discord.Interaction, mode: str = None):
+        """Switch a guild between one card per room (mode None) and a board sorted by mode"""
+        if mode is not None and mode not in BOARD_SORTS:
+            raise ValueError(f"Unknown board sort '{mode}'.")
+        guild = interaction.guild
+        if not (await self.access(interaction)).room_admin:
+            raise PermissionError("You must have the admin role to change the room board.")
+        def state(conn):
+            if not conn.root.room_channels.get(guild.id, None):
+                raise ValueError("No room channel set for this server. Please set a room channel first.")
+            guild_rooms = self._guild(conn, guild.id, create=True)
+            if guild_rooms.board is None:
+                guild_rooms.board = PersistentList()
+            old_messages = []
+            if bool(guild_rooms.board_mode) != bool(mode):
+                # Switching layouts replaces every existing card or board message
+                if guild_rooms.board_mode:
+                    old_messages = [(page.channel_id, page.message_id) for page in guild_rooms.board if page.message_id]
+                    del guild_rooms.board[:]
+                    guild_rooms.board_index.clear()
+                else:
+                    old_messages = [(room.channel_id, room.message_id) for room in guild_rooms.rooms.values() if room.message_id]
+                for room in guild_rooms.rooms.values():
+                    room.message_id = None
+                    room.channel_id = None
+                    room.board_slot = None
+                if guild_rooms.message_index is not None:
+                    guild_rooms.message_index.clear()
+            if guild_rooms.board_mode != mode:
+                # Pages are found by their first room's entry in the sort, which is changing
+                for page in guild_rooms.board:
+                    page.first_entry = None
+            guild_rooms.board_mode = mode
+            return old_messages, list(guild_rooms.rooms.keys())
+        old_messages, room_keys = await self.storage.write(state)
+        for channel_id, message_id in old_messages:
+            await self.render_queue.bucket(channel_id).acquire()
+            await delete_message(guild, channel_id, message_id)
+        if mode:
+            await self._relayout_board(guild)
+        else:
+            await self.post_missing_cards(guild, room_keys)
 
     async def remove_room(self, interaction: discord.Interaction, hotel: str, room_number: int):
         room_key = f"{hotel}-{room_number}"
-        with self.db.transaction() as conn:
-            room = conn.root.rooms.get(room_key, None)
+        def state(conn):
+            room = self._delete_room(conn, interaction.guild.id, room_key)
             if not room:
                 raise ValueError("Room does not exist.")
-            await room.cleanup(interaction)
-            del conn.root.rooms[room_key]
+            mode = self._guild(conn, interaction.guild.id).board_mode
+            return RoomCard.from_room(room), self._relayout_in(conn, interaction.guild.id, changed_span(mode, sort_entry(mode, room, room_key)))
+        card, board_changes = await self.storage.write(state)
+        # The state logged is the room's last, so it can be looked up after it's gone
+        self._log(interaction.guild.id, card, interaction.user.id, "remove")
+        self.autocomplete.remove_room(interaction.guild.id, room_key)
+        if board_changes:
+            # Its page is shared with other rooms, the gap was closed with the remove
+            await self._apply_board_changes(interaction.guild, board_changes)
+        else:
+            if card.message_id:
+                await self.render_queue.bucket(card.channel_id).acquire()
+            await card.delete(interaction.guild)
 
-class Room(persistent.Persistent):
-    members = None
-    message_id = None
-    channel_id = None
-    status = RoomStatus.OPEN
-    vibe = RoomVibe.CHILL
-    room_name = None
-    last_updated = None
+    async def room_history(self, interaction: discord.Interaction, hotel: str, room_number: int, before: int = None):
+        """One page of a room's logged changes, newest first, as (ChangeEntries, next cursor) (admin only)"""
+        if not (await self.access(interaction)).room_admin:
+            raise PermissionError("You must have the admin role to view room history.")
+        # Include changes still waiting to be written
+        await self.change_log.flush()
+        def state(conn):
+            guild_rooms = self._guild(conn, interaction.guild.id)
+            if guild_rooms is None:
+                return [], None
+            return room_history(guild_rooms, f"{hotel}-{room_number}", before, HISTORY_PAGE_SIZE)
+        return await self.storage.read(state)
 
-    def __init__(self, requestor: discord.Member, hotel: str, room_number: int, message: discord.Message = None, room_name: str = None):
-        self.members = [requestor.id]
-        self.message_id = message.id if message else None
-        self.channel_id = message.channel.id if message else None
-        self.hotel = hotel
-        self.room_number = room_number
-        self.room_name = room_name
-        self.last_updated = datetime.now(timezone.utc)
+    async def restore_room(self, interaction: discord.Interaction, hotel: str, room_number: int, entry_id: int) -> ChangeEntry:
+        """Put a room's name, members, status and vibe back to how they were after a logged
+        change (admin only). The room must still exist under the same hotel and number."""
+        if not (await self.access(interaction)).room_admin:
+            raise PermissionError("You must have the admin role to restore rooms.")
+        room_key = f"{hotel}-{room_number}"
+        await self.change_log.flush()
+        def state(conn):
+            guild_rooms = self._guild(conn, interaction.guild.id)
+            entry = get_entry(guild_rooms, entry_id) if guild_rooms else None
+            if entry is None or entry.room_key != room_key or entry.state is None:
+                raise ValueError(f"Room {hotel} {room_number} has no change {entry_id} to restore.")
+            room = guild_rooms.rooms.get(room_key, None)
+            if room is None:
+                raise ValueError("Room does not exist.")
+            _, _, room_name, members, status, vibe, _ = entry.state
+            old_entry = sort_entry("status", room, room_key)
+            room_index.unindex_room(guild_rooms, room, room_key)
+            room.room_name = room_name
+            room.members = tuple(members)
+            room._status = status
+            room._vibe = vibe
+            room.stale = False
+            room.last_updated = datetime.now(timezone.utc)
+            room_index.index_room(guild_rooms, room, room_key)
+            mode = guild_rooms.board_mode if guild_rooms.board_mode == "status" else None
+            board_changes = self._relayout_in(conn, interaction.guild.id, changed_span(mode, old_entry, sort_entry("status", room, room_key)))
+            return entry, RoomCard.from_room(room), board_changes
+        entry, card, board_changes = await self.storage.write(state)
+        self._log(interaction.guild.id, card, interaction.user.id, "restore", entry_id)
+        self.autocomplete.set_room(interaction.guild.id, card.key, card.room_name, card.members)
+        if board_changes:
+            await self._apply_board_changes(interaction.guild, board_changes)
+        self._schedule_card(interaction.guild, card)
+        return entry
 
-    def person_in_room(self, person: discord.Member):
-        return person.id in self.members
+@dataclass
+class RoomCard:
+    """Plain snapshot of a room taken inside a transaction. The Discord side effects are
+    applied from the snapshot after the transaction commits, on the event loop."""
+    hotel: str
+    room_number: int
+    room_name: str
+    status: RoomStatus
+    vibe: RoomVibe
+    members: tuple
+    last_updated: datetime
+    channel_id: int
+    message_id: int
+    board_slot: int = None
+    # Status not updated within the status TTL, shown greyed out
+    stale: bool = False
 
-    def get_status_emoji(self):
-        """Returns a colored emoji indicator based on room status"""
-        if self.status == RoomStatus.OPEN:
-            return "🟦"  # Blue square
-        elif self.status == RoomStatus.ASK:
-            return "🟧"  # Orange square
-        elif self.status == RoomStatus.DND:
-            return "🟥"  # Red square
-        return "⬜"  # Default white square
-
-    async def create_embed(self, guild: discord.Guild):
-        """Creates a Discord embed card for the room"""
+    @classmethod
+    def from_room(cls, room: "Room"):
+        return cls(room.hotel, room.room_number, room.room_name, room.status, room.vibe, tuple(room.members),
+                   room.last_updated, room.channel_id, room.message_id, room.board_slot, room.stale)
+
+    @property
+    def key(self) -> str:
+        return f"{self.hotel}-{self.room_number}"
+
+    def logged_state(self) -> tuple:
+        """The room's state as the change log stores it, with status and vibe as small ints"""
+        return (self.hotel, self.room_number, self.room_name, self.members,
+                ROOM_STATUSES.index(self.status), ROOM_VIBES.index(self.vibe), self.stale)
+
+    def create_embed(self, guild: discord.Guild):
+        """Creates a Discord embed card for the room, reusing the cached one for the same state"""
+        state = (self.hotel, self.room_number, self.room_name, self.status, self.vibe, self.members, self.last_updated, self.stale)
+        return render_cache.embed(state, self._build_embed)
+
+    def _build_embed(self):
+        # Expired statuses are greyed out until a member updates them
+        emoji = "⬜" if self.stale else STATUS_EMOJI.get(self.status, '⬜')
         # Use room name as title if provided, otherwise use hotel-room number
         if self.room_name:
-            title = f"{self.get_status_emoji()} {self.room_name}"
+            title = f"{emoji} {self.room_name}"
         else:
-            title = f"{self.get_status_emoji()} Room"
+            title = f"{emoji} Room"
 
         embed = discord.Embed(
             title=title,
-            color=self.status.value.color,
+            color=discord.Color.light_grey() if self.stale else self.status.value.color,
             timestamp=self.last_updated
         )
 
         # Add hotel-room number as a field in the body
         embed.add_field(name="Location", value=f"{self.hotel} - Room {self.room_number}", inline=False)
 
-        embed.add_field(name="Status", value=self.status.value.name, inline=True)
+        status = f"{self.status.value.name} (expired)" if self.stale else self.status.value.name
+        embed.add_field(name="Status", value=status, inline=True)
         embed.add_field(name="Vibe", value=self.vibe.value.name, inline=True)
 
-        # Get member names
-        member_mentions = []
-        for member_id in self.members:
-            member = guild.get_member(member_id)
-            if member:
-                member_mentions.append(member.mention)
-            else:
-                member_mentions.append(f"<@{member_id}>")  # Fallback to mention format
+        # Mentions are resolved to display names by the client, so this doesn't depend on
+        # the member cache and the embed is a pure function of the room's state
+        member_mentions = [f"<@{member_id}>" for member_id in self.members]
 
         members_text = ", ".join(member_mentions) if member_mentions else "No members"
         # Use inline=True to make the card wider and take less vertical space
@@ -246,34 +1040,213 @@ class Room(persistent.Persistent):
 
         return embed
 
-    async def add_person(self, context: discord.Interaction, person: discord.Member, is_admin: bool = False):
-        if not is_admin and not context.user.id in self.members:
+    async def edit(self, guild: discord.Guild, bucket: ChannelBucket) -> bool:
+        """Edit the card in place, waiting on the channel's rate limit bucket first. Returns
+        False if the card's message or channel no longer exists, and None if the card already
+        shows this state so nothing was sent."""
+        embed = self.create_embed(guild)
+        content = digest([embed])
+        if render_cache.unchanged(guild.id, self.key, content):
+            return None
+        message = message_cache.get(guild, self.channel_id, self.message_id)
+        if message is None:
+            return False
+        try:
+            await bucket.acquire()
+            await message.edit(embed=embed)
+        except discord.NotFound:
+            render_cache.invalidate(guild.id, self.key)
+            return False
+        render_cache.record(guild.id, self.key, content)
+        return True
+
+    async def delete(self, guild: discord.Guild):
+        render_cache.invalidate(guild.id, self.key)
+        await delete_message(guild, self.channel_id, self.message_id)
+
+async def delete_message(guild: discord.Guild, channel_id: int, message_id: int):
+    """Delete a card or board message by its IDs, ignoring messages that are already gone"""
+    message = message_cache.get(guild, channel_id, message_id)
+    message_cache.discard(channel_id, message_id)
+    if message is None:
+        return
+    try:
+        await message.delete()
+    except discord.NotFound:
+        # Already gone, nothing to clean up
+        pass
+
+class GuildRooms(persistent.Persistent):
+    """One guild's rooms and their indexes. Each guild gets its own trees so lookups never
+    cross guilds and concurrent updates in different guilds never conflict."""
+    # Board mode packs room cards into shared messages; None means one message per room
+    board_mode = None
+    board = None
+    board_index = None
+    updated_index = None
+    message_index = None
+    location_index = None
+    status_index = None
+    vibe_index = None
+    # Created with the guild's first logged change, see change_log
+    change_log = None
+    history_index = None
+    # Bumped with every change other processes may have cached, see cache_sync
+    revision = None
+
+    def __init__(self):
+        self.rooms = OOBTree.BTree()  # "hotel-room_number" -> Room
+        self.member_index = LOBTree.BTree()  # see room_index
+        self.name_index = OOBTree.BTree()
+        self.updated_index = room_index.new_updated_index()
+        self.message_index = LOBTree.BTree()
+        self.location_index = OOBTree.TreeSet()
+        self.status_index = OOBTree.TreeSet()
+        self.vibe_index = OOBTree.TreeSet()
+        self.board = PersistentList()  # BoardPage per board message, in channel order
+        self.board_index = LOBTree.BTree()  # see board
+        self.revision = Length()
+
+# Bump when Room's stored attributes change, and teach Room._upgrade about the old layout
+ROOM_SCHEMA = 3
+# Statuses and vibes are stored by their position here; only ever append to these enums
+ROOM_STATUSES = list(RoomStatus)
+ROOM_VIBES = list(RoomVibe)
+
+def describe_change(entry: ChangeEntry) -> str:
+    """One line summary of a logged change, for /room_history"""
+    actor = f"<@{entry.actor_id}>" if entry.actor_id else "the bot"
+    line = f"`{entry.entry_id}` <t:{int(entry.entry_id // 1_000_000)}:f> {entry.action} by {actor}"
+    if entry.action in ("add_member", "member_left"):
+        line += f" (<@{entry.detail}>)"
+    elif entry.action in ("move", "edit") and entry.detail:
+        line += f" ({'to' if entry.action == 'move' else 'from'} {entry.detail})"
+    if entry.state is not None:
+        hotel, room_number, room_name, members, status, vibe, stale = entry.state
+        status = ROOM_STATUSES[status]
+        line += f": {'⬜' if stale else STATUS_EMOJI.get(status, '⬜')} {status.value.name}, {ROOM_VIBES[vibe].value.name}, {len(members)} members"
+        if room_name:
+            line += f", named {room_name}"
+    return line
+
+def _epoch(when: datetime) -> int:
+    return int(when.timestamp())
+
+class Room(persistent.Persistent):
+    """A hotel room and its card. Stored compactly: members as a sorted tuple of IDs kept
+    inline in the record, status and vibe as small ints and the last update as epoch seconds,
+    with no per-instance __dict__."""
+    __slots__ = ('_schema', 'guild_id', 'hotel', 'room_number', 'room_name', 'members', '_status', '_vibe',
+                 '_updated', 'message_id', 'channel_id', 'board_slot', 'stale')
+
+    def __init__(self, requestor: discord.Member, hotel: str, room_number: int, message: discord.Message = None, room_name: str = None):
+        self._schema = ROOM_SCHEMA
+        self.members = (requestor.id,)
+        self.message_id = message.id if message else None
+        self.channel_id = message.channel.id if message else None
+        self.hotel = hotel
+        self.room_number = room_number
+        self.room_name = room_name
+        self.guild_id = requestor.guild.id
+        self._status = ROOM_STATUSES.index(RoomStatus.OPEN)
+        self._vibe = ROOM_VIBES.index(RoomVibe.CHILL)
+        self._updated = _epoch(datetime.now(timezone.utc))
+        # Position on its board message when the guild uses board mode
+        self.board_slot = None
+        # Set by the expiry sweep, cleared when the status is updated
+        self.stale = False
+
+    def __setstate__(self, state):
+        # Records from before ROOM_SCHEMA 2 were plain instance dicts; upgrade them as they load.
+        # The upgraded form is written back the next time the room is modified.
+        if isinstance(state, dict):
+            state = (None, self._upgrade(state))
+        elif state[1].get('_schema', None) == 2:
+            # Schema 3 added stale
+            state[1].update(_schema=ROOM_SCHEMA, stale=False)
+        super().__setstate__(state)
+
+    @staticmethod
+    def _upgrade(old: dict) -> dict:
+        status = old.get('status', RoomStatus.OPEN)
+        vibe = old.get('vibe', RoomVibe.CHILL)
+        last_updated = old.get('last_updated', None)
+        return {
+            '_schema': ROOM_SCHEMA,
+            'guild_id': old.get('guild_id', None),
+            'hotel': old.get('hotel', None),
+            'room_number': old.get('room_number', None),
+            'room_name': old.get('room_name', None),
+            'members': tuple(sorted(set(old.get('members', None) or ()))),
+            '_status': ROOM_STATUSES.index(status),
+            '_vibe': ROOM_VIBES.index(vibe),
+            '_updated': _epoch(last_updated) if last_updated else 0,
+            'message_id': old.get('message_id', None),
+            'channel_id': old.get('channel_id', None),
+            'board_slot': old.get('board_slot', None),
+            'stale': False,
+        }
+
+    @property
+    def status(self) -> RoomStatus:
+        return ROOM_STATUSES[self._status]
+
+    @status.setter
+    def status(self, status: RoomStatus):
+        self._status = ROOM_STATUSES.index(status)
+
+    @property
+    def vibe(self) -> RoomVibe:
+        return ROOM_VIBES[self._vibe]
+
+    @vibe.setter
+    def vibe(self, vibe: RoomVibe):
+        self._vibe = ROOM_VIBES.index(vibe)
+
+    @property
+    def last_updated(self) -> datetime:
+        return datetime.fromtimestamp(self._updated, timezone.utc)
+
+    @last_updated.setter
+    def last_updated(self, when: datetime):
+        self._updated = _epoch(when)
+
+    @property
+    def key(self) -> str:
+        return f"{self.hotel}-{self.room_number}"
+
+    def has_member(self, member_id: int) -> bool:
+        index = bisect.bisect_left(self.members, member_id)
+        return index < len(self.members) and self.members[index] == member_id
+
+    def person_in_room(self, person: discord.Member):
+        return self.has_member(person.id)
+
+    def get_status_emoji(self):
+        """Returns a colored emoji indicator based on room status"""
+        return STATUS_EMOJI.get(self.status, "⬜")  # Default white square
+
+    def create_embed(self, guild: discord.Guild):
+        """Creates a Discord embed card for the room"""
+        return RoomCard.from_room(self).create_embed(guild)
+
+    def add_person(self, requestor: discord.Member, person: discord.Member, is_admin: bool = False):
+        if not is_admin and not self.has_member(requestor.id):
             raise PermissionError("You do not have permission to add people to this room.")
-        # Add role to person
-        if person.id in self.members:
+        if self.has_member(person.id):
             raise ValueError("Person is already in the room.")
-        self.members.append(person.id)
+        # Reassigning the tuple is what marks the room changed
+        self.members = tuple(sorted(self.members + (person.id,)))
         self.last_updated = datetime.now(timezone.utc)
 
-        # Update the room card to show the new member
-        channel = context.guild.get_channel(self.channel_id)
-        message = await channel.fetch_message(self.message_id)
-        embed = await self.create_embed(context.guild)
-        await message.edit(embed=embed)
+    def remove_member(self, member_id: int):
+        """Drop a member without a permission check, for members who left the guild"""
+        self.members = tuple(member for member in self.members if member != member_id)
 
-    async def update_status(self, context: discord.Interaction, requestor: discord.Member, status: RoomStatus, vibe: RoomVibe, is_admin: bool = False):
-        if not is_admin and requestor.id not in self.members:
+    def update_status(self, requestor: discord.Member, status: RoomStatus, vibe: RoomVibe, is_admin: bool = False):
+        if not is_admin and not self.has_member(requestor.id):
             raise PermissionError("You are not a member of this room.")
         self.status = status
         self.vibe = vibe
+        self.stale = False
         self.last_updated = datetime.now(timezone.utc)
-        channel = context.guild.get_channel(self.channel_id)
-        message = await channel.fetch_message(self.message_id)
-        embed = await self.create_embed(context.guild)
-        await message.edit(embed=embed)
-    
-    async def cleanup(self, context: discord.Interaction):
-        # Delete message
-        channel = context.guild.get_channel(self.channel_id)
-        message = await channel.fetch_message(self.message_id)
-        await message.delete()
\ No newline at end of file
@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+import re
+from dataclasses import dataclass
+
+# Accepts raw IDs and <@id> / <@!id> mentions
+MEMBER_PATTERN = re.compile(r"^(?:<@!?)?(\d{15,20})>?$")
+# Rows are reported back with at most this many errors so the reply stays readable
+MAX_REPORTED_ERRORS = 20
+
+@dataclass
+class ImportRow:
+    hotel: str
+    room_number: int
+    room_name: str
+    member_ids: tuple
+
+    @property
+    def key(self) -> str:
+        return f"{self.hotel}-{self.room_number}"
+
+def _split_members(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(member).strip() for member in value]
+    return [member for member in re.split(r"[\s,;]+", str(value).strip()) if member]
+
+def parse_member_ids(value):
+    """Member IDs from a list or a string of IDs and mentions, without duplicates.
+    Returns (member_ids, invalid entries)."""
+    member_ids = []
+    invalid = []
+    for member in _split_members(value):
+        match = MEMBER_PATTERN.match(member)
+        if not match:
+            invalid.append(member)
+        elif int(match.group(1)) not in member_ids:
+            member_ids.append(int(match.group(1)))
+    return member_ids, invalid
+
+def _records(filename: str, data: bytes):
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        records = json.loads(text)
+        if isinstance(records, dict):
+            records = records.get("rooms", [])
+        if not isinstance(records, list):
+            raise ValueError("JSON import must be a list of rooms or an object with a \"rooms\" list.")
+        return records
+    if filename.lower().endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(text))
+        # Header names are matched case-insensitively
+        return [{(key or "").strip().lower(): value for key, value in row.items()} for row in reader]
+    raise ValueError("Import file must be a .csv or .json file.")
+
+def parse_room_import(filename: str, data: bytes):
+    """Parse and validate a room list. Each room needs hotel and room_number, and may have
+    room_name and members (IDs or mentions, separated by spaces, commas or semicolons in CSV).
+
+    Raises ValueError listing every invalid row, so nothing is imported unless the whole file is valid."""
+    errors = []
+    rows = []
+    seen = set()
+    for line, record in enumerate(_records(filename, data), start=2 if filename.lower().endswith(".csv") else 1):
+        if not isinstance(record, dict):
+            errors.append(f"Row {line}: expected an object.")
+            continue
+        hotel = str(record.get("hotel") or "").strip()
+        room_name = str(record.get("room_name") or "").strip() or None
+        if not hotel:
+            errors.append(f"Row {line}: missing hotel.")
+            continue
+        try:
+            room_number = int(str(record.get("room_number")).strip())
+        except ValueError:
+            errors.append(f"Row {line}: room_number must be a number.")
+            continue
+        member_ids, invalid = parse_member_ids(record.get("members"))
+        errors.extend(f"Row {line}: '{member}' is not a member ID or mention." for member in invalid)
+        row = ImportRow(hotel, room_number, room_name, tuple(member_ids))
+        if row.key in seen:
+            errors.append(f"Row {line}: room {hotel} {room_number} appears more than once.")
+            continue
+        seen.add(row.key)
+        rows.append(row)
+    if errors:
+        raise ValueError(format_errors(errors))
+    if not rows:
+        raise ValueError("Import file contains no rooms.")
+    return rows
+
+def format_errors(errors) -> str:
+    shown = errors[:MAX_REPORTED_ERRORS]
+    if len(errors) > len(shown):
+        shown.append(f"...and {len(errors) - len(shown)} more.")
+    return "Import failed, nothing was created:\n" + "\n".join(shown)
@@ -0,0 +1,194 @@
+from BTrees import OOBTree, LOBTree
+import heapq
+import itertools
+import logging
+import sys
+import zlib
+
+logger = logging.getLogger('conbot')
+
+# Secondary indexes over a guild's rooms (see GuildRooms in room.py). They must be updated
+# in the same transaction as the room mutation so they never drift from the rooms themselves.
+#   member_index: member_id -> set of room keys
+#   name_index:   normalized room name -> set of room keys
+#   updated_index: tuple of UPDATED_INDEX_SHARDS sets of (last updated epoch, room key),
+#                  oldest first, for status expiry. Rooms whose status already expired are
+#                  left out until it is updated again.
+#   message_index: card message_id -> room key, for rooms with their own card. Board pages
+#                  are found through GuildRooms.board_index instead.
+#   location_index: set of (casefolded hotel, room number, room key), for listing in order
+#   status_index:   set of (status, casefolded hotel, room number, room key)
+#   vibe_index:     set of (vibe, casefolded hotel, room number, room key)
+#                   Status and vibe are the small ints Room stores them as.
+
+# Every status update appends to the end of updated_index, so with one tree concurrent
+# updates all land in its last bucket, and its splits change the tree every other update
+# reads. Rooms are spread over several trees by a hash of their key instead.
+UPDATED_INDEX_SHARDS = 16
+
+def normalize_room_name(name: str) -> str:
+    return name.strip().casefold()
+
+def _add(tree, key, room_key: str):
+    keys = tree.get(key, None)
+    if keys is None:
+        keys = OOBTree.TreeSet()
+        tree[key] = keys
+    keys.add(room_key)
+
+def _discard(tree, key, room_key: str):
+    keys = tree.get(key, None)
+    if keys is None:
+        return
+    if room_key in keys:
+        keys.remove(room_key)
+    if not keys:
+        del tree[key]
+
+def index_member(guild_rooms, member_id: int, room_key: str):
+    _add(guild_rooms.member_index, member_id, room_key)
+
+def unindex_member(guild_rooms, member_id: int, room_key: str):
+    _discard(guild_rooms.member_index, member_id, room_key)
+
+def index_name(guild_rooms, room_name: str, room_key: str):
+    if room_name:
+        _add(guild_rooms.name_index, normalize_room_name(room_name), room_key)
+
+def unindex_name(guild_rooms, room_name: str, room_key: str):
+    if room_name:
+        _discard(guild_rooms.name_index, normalize_room_name(room_name), room_key)
+
+def new_updated_index() -> tuple:
+    return tuple(OOBTree.TreeSet() for _ in range(UPDATED_INDEX_SHARDS))
+
+def _updated_shard(guild_rooms, room_key: str):
+    # crc32 rather than hash(), which differs between processes
+    return guild_rooms.updated_index[zlib.crc32(room_key.encode()) % len(guild_rooms.updated_index)]
+
+def index_updated(guild_rooms, room, room_key: str):
+    # Guilds from before the index existed get it built by the first expiry sweep
+    if guild_rooms.updated_index is not None and not room.stale:
+        _updated_shard(guild_rooms, room_key).add((room._updated, room_key))
+
+def unindex_updated(guild_rooms, room, room_key: str):
+    if guild_rooms.updated_index is not None:
+        _updated_shard(guild_rooms, room_key).discard((room._updated, room_key))
+
+def index_message(guild_rooms, room, room_key: str):
+    # Guilds from before the index existed get it built the first time a card is deleted
+    if guild_rooms.message_index is not None and room.message_id and room.board_slot is None:
+        guild_rooms.message_index[room.message_id] = room_key
+
+def unindex_message(guild_rooms, room, room_key: str):
+    if guild_rooms.message_index is not None and room.message_id and guild_rooms.message_index.get(room.message_id, None) == room_key:
+        del guild_rooms.message_index[room.message_id]
+
+def location_entry(room, room_key: str) -> tuple:
+    return (room.hotel.casefold(), room.room_number, room_key)
+
+def index_status(guild_rooms, room, room_key: str):
+    # Guilds from before these indexes existed get them built at startup
+    if guild_rooms.status_index is not None:
+        location = location_entry(room, room_key)
+        guild_rooms.status_index.add((room._status,) + location)
+        guild_rooms.vibe_index.add((room._vibe,) + location)
+
+def unindex_status(guild_rooms, room, room_key: str):
+    if guild_rooms.status_index is not None:
+        location = location_entry(room, room_key)
+        guild_rooms.status_index.discard((room._status,) + location)
+        guild_rooms.vibe_index.discard((room._vibe,) + location)
+
+def index_location(guild_rooms, room, room_key: str):
+    if guild_rooms.location_index is not None:
+        guild_rooms.location_index.add(location_entry(room, room_key))
+
+def unindex_location(guild_rooms, room, room_key: str):
+    if guild_rooms.location_index is not None:
+        guild_rooms.location_index.discard(location_entry(room, room_key))
+
+def index_room(guild_rooms, room, room_key: str):
+    for member_id in room.members:
+        index_member(guild_rooms, member_id, room_key)
+    index_name(guild_rooms, room.room_name, room_key)
+    index_updated(guild_rooms, room, room_key)
+    index_message(guild_rooms, room, room_key)
+    index_location(guild_rooms, room, room_key)
+    index_status(guild_rooms, room, room_key)
+
+def unindex_room(guild_rooms, room, room_key: str):
+    for member_id in room.members:
+        unindex_member(guild_rooms, member_id, room_key)
+    unindex_name(guild_rooms, room.room_name, room_key)
+    unindex_updated(guild_rooms, room, room_key)
+    unindex_message(guild_rooms, room, room_key)
+    unindex_location(guild_rooms, room, room_key)
+    unindex_status(guild_rooms, room, room_key)
+
+def member_room_keys(guild_rooms, member_id: int):
+    if guild_rooms is None:
+        return ()
+    return guild_rooms.member_index.get(member_id, ())
+
+def name_room_keys(guild_rooms, room_name: str):
+    if guild_rooms is None:
+        return ()
+    return guild_rooms.name_index.get(normalize_room_name(room_name), ())
+
+def expired_room_keys(guild_rooms, cutoff: int, limit: int):
+    """Keys of up to limit rooms last updated before the cutoff epoch, oldest first"""
+    if guild_rooms is None or guild_rooms.updated_index is None:
+        return []
+    expired = heapq.merge(*(shard.keys(max=(cutoff,), excludemax=True) for shard in guild_rooms.updated_index))
+    return [room_key for _, room_key in itertools.islice(expired, limit)]
+
+def message_room_key(guild_rooms, message_id: int):
+    if guild_rooms is None:
+        return None
+    if guild_rooms.message_index is None:
+        rebuild_message_index(guild_rooms)
+    return guild_rooms.message_index.get(message_id, None)
+
+def rebuild_message_index(guild_rooms):
+    guild_rooms.message_index = LOBTree.BTree()
+    for room_key, room in guild_rooms.rooms.items():
+        index_message(guild_rooms, room, room_key)
+
+def rebuild_listing_indexes(guild_rooms):
+    guild_rooms.location_index = OOBTree.TreeSet()
+    guild_rooms.status_index = OOBTree.TreeSet()
+    guild_rooms.vibe_index = OOBTree.TreeSet()
+    for room_key, room in guild_rooms.rooms.items():
+        index_location(guild_rooms, room, room_key)
+        index_status(guild_rooms, room, room_key)
+
+def rebuild_updated_index(guild_rooms):
+    guild_rooms.updated_index = new_updated_index()
+    for room_key, room in guild_rooms.rooms.items():
+        index_updated(guild_rooms, room, room_key)
+
+def rebuild_indexes(guild_rooms) -> int:
+    """Drop and rebuild a guild's room indexes from its rooms. Returns the number of rooms indexed."""
+    guild_rooms.member_index = LOBTree.BTree()
+    guild_rooms.name_index = OOBTree.BTree()
+    guild_rooms.updated_index = new_updated_index()
+    guild_rooms.message_index = LOBTree.BTree()
+    guild_rooms.location_index = OOBTree.TreeSet()
+    guild_rooms.status_index = OOBTree.TreeSet()
+    guild_rooms.vibe_index = OOBTree.TreeSet()
+    for room_key, room in guild_rooms.rooms.items():
+        index_room(guild_rooms, room, room_key)
+    return len(guild_rooms.rooms)
+
+if __name__ == "__main__":
+    # One-shot rebuild for an existing database: python room_index.py [rooms.fs]
+    import ZODB, ZODB.FileStorage
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else "rooms.fs"
+    db = ZODB.DB(ZODB.FileStorage.FileStorage(path))
+    with db.transaction() as conn:
+        for guild_id, guild_rooms in conn.root.guilds.items():
+            count = rebuild_indexes(guild_rooms)
+            logger.info(f"Rebuilt room indexes for {count} rooms in guild {guild_id}")
+    db.close()
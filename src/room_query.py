@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from room_index import normalize_room_name
+
+# Rooms per /list_rooms page
+PAGE_SIZE = 10
+# Index entries examined per page at most. A selective filter the chosen index can't answer
+# (say a vibe within a large hotel) then returns a short page rather than scanning every room.
+MAX_SCAN = 1000
+
+@dataclass(frozen=True)
+class RoomQuery:
+    """Filters for listing a guild's rooms. Status and vibe are the small ints Room stores."""
+    hotel: str = None
+    status: int = None
+    vibe: int = None
+    member_id: int = None
+    # Prefix of the room name
+    name: str = None
+
+def _prefixed(keys, prefix: tuple, after):
+    """Entries of an ordered set of tuples starting with prefix, after the cursor"""
+    start = after if after is not None else prefix
+    for entry in keys.keys(min=start, excludemin=after is not None):
+        if entry[:len(prefix)] != prefix:
+            return
+        yield entry
+
+def _named(name_index, prefix: str, after):
+    """(name, room key) for every room whose normalized name starts with prefix"""
+    start = after[0] if after is not None else prefix
+    for name, room_keys in name_index.items(min=start):
+        if not name.startswith(prefix):
+            return
+        if after is not None and name == after[0]:
+            room_keys = room_keys.keys(min=after[1], excludemin=True)
+        for room_key in room_keys:
+            yield (name, room_key)
+
+def _entries(guild_rooms, query: RoomQuery, after):
+    """Entries of the most selective index for the query, each ending in a room key.
+
+    Members have few rooms and names few matches, so those indexes go first. The status and
+    vibe indexes lead with the status or vibe and then sort like the location index, so a
+    hotel filter narrows their range too."""
+    hotel = (query.hotel.casefold(),) if query.hotel else ()
+    if query.member_id is not None:
+        room_keys = guild_rooms.member_index.get(query.member_id, None)
+        if room_keys is None:
+            return iter(())
+        return ((room_key,) for room_key in room_keys.keys(min=after[0] if after else None, excludemin=after is not None))
+    if query.name:
+        return _named(guild_rooms.name_index, normalize_room_name(query.name), after)
+    if query.status is not None:
+        return _prefixed(guild_rooms.status_index, (query.status,) + hotel, after)
+    if query.vibe is not None:
+        return _prefixed(guild_rooms.vibe_index, (query.vibe,) + hotel, after)
+    return _prefixed(guild_rooms.location_index, hotel, after)
+
+def _matches(room, query: RoomQuery) -> bool:
+    if query.hotel and room.hotel.casefold() != query.hotel.casefold():
+        return False
+    if query.status is not None and room._status != query.status:
+        return False
+    if query.vibe is not None and room._vibe != query.vibe:
+        return False
+    if query.member_id is not None and not room.has_member(query.member_id):
+        return False
+    if query.name and not normalize_room_name(room.room_name or "").startswith(normalize_room_name(query.name)):
+        return False
+    return True
+
+def query_rooms(guild_rooms, query: RoomQuery, cursor=None, limit: int = PAGE_SIZE):
+    """One page of the guild's rooms matching query, as (rooms, next cursor).
+
+    The cursor is the last index entry the page covered, so the next page resumes with a
+    range query from there and never rescans earlier entries. It is None on the last page."""
+    rooms = []
+    scanned = 0
+    last = None
+    for entry in _entries(guild_rooms, query, cursor):
+        room = guild_rooms.rooms.get(entry[-1], None)
+        if room is not None and _matches(room, query):
+            if len(rooms) == limit:
+                # There is at least one more match, so hand out a cursor
+                return rooms, last
+            rooms.append(room)
+        last = entry
+        scanned += 1
+        if scanned >= MAX_SCAN:
+            return rooms, last
+    return rooms, None
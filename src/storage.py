@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import transaction
+import ZODB, ZODB.FileStorage
+from ZODB.POSException import ConflictError
+import metrics
+from instrumentation import current_command
+
+logger = logging.getLogger('conbot')
+
+# How many times a transaction is tried before a ConflictError is given up on. Retry n
+# waits a random time up to CONFLICT_BACKOFF * 2**(n - 1) seconds, at most MAX_CONFLICT_BACKOFF.
+MAX_COMMIT_ATTEMPTS = 10
+CONFLICT_BACKOFF = 0.01
+MAX_CONFLICT_BACKOFF = 0.5
+STORAGE_MODES = ("file", "compact")
+
+transaction_latency = metrics.histogram("storage_transaction_seconds", "Time spent inside a ZODB transaction, including commit",
+                                        labelnames=("command",))
+conflict_retries = metrics.counter("storage_conflict_retries_total", "Write transactions retried after a ConflictError",
+                                   labelnames=("command",))
+conflict_failures = metrics.counter("storage_conflict_failures_total", "Transactions given up on after MAX_COMMIT_ATTEMPTS conflicts",
+                                    labelnames=("command",))
+pack_latency = metrics.histogram("storage_pack_seconds", "Time taken by an online pack", buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+                                 labelnames=("path",))
+file_size = metrics.gauge("storage_file_bytes", "Size of the storage file, updated at startup and after each pack",
+                          labelnames=("path",))
+loop_lag = metrics.histogram("event_loop_lag_seconds", "How late the event loop woke up for a scheduled tick",
+                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+class StorageBusyError(ValueError):
+    """A transaction kept conflicting with concurrent ones until it ran out of retries.
+    Its message is shown to users as is; the ConflictError is chained for the logs."""
+
+@dataclass(frozen=True)
+class StorageConfig:
+    """Where and how a manager's database is stored.
+
+    Neither mode uses blobs; everything lives in the one FileStorage file. FileStorage only
+    ever appends, so every committed change grows the file until it is packed. "file" keeps
+    pack_days of history and the pre-pack file as path.old; "compact" keeps neither, for
+    hosts where disk is tight and undo through old revisions isn't wanted.
+
+    With zeo_address set, the database is the storage named zeo_storage on that ZEO server
+    instead, so several bot processes can share it. path then only names it in logs and
+    metrics, and the server's own configuration decides where and how it's stored."""
+    path: str
+    # Objects kept in each connection's cache. Every storage pool thread has its own connection.
+    cache_size: int = 5000
+    # Approximate bytes per connection cache, 0 for no limit
+    cache_size_bytes: int = 0
+    mode: str = "file"
+    # Days of old revisions a pack keeps in "file" mode
+    pack_days: float = 1.0
+    # "host:port" or a Unix socket path
+    zeo_address: str = None
+    zeo_storage: str = "1"
+    # Bytes of objects the ZEO client keeps in memory across connections
+    zeo_cache_size: int = 64 * 1024 * 1024
+
+    def __post_init__(self):
+        if self.mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {self.mode!r}, expected one of {', '.join(STORAGE_MODES)}")
+
+    @property
+    def retention_days(self) -> float:
+        return self.pack_days if self.mode == "file" else 0
+
+def _zeo_address(address: str):
+    host, _, port = address.rpartition(":")
+    return (host, int(port)) if host and port.isdigit() else address
+
+def open_db(config: StorageConfig) -> ZODB.DB:
+    """Open the database described by config, creating its directory if needed.
+
+    FileStorage rebuilds its in-memory index by scanning the file unless path.index is
+    current, which it only is after a clean close or a pack. Close the StorageExecutor on
+    shutdown so the next start reads the index instead of the whole file."""
+    start = time.perf_counter()
+    if config.zeo_address:
+        # Only needed for shared deployments
+        import ZEO.ClientStorage
+        storage = ZEO.ClientStorage.ClientStorage(_zeo_address(config.zeo_address), storage=config.zeo_storage,
+                                                  cache_size=config.zeo_cache_size, wait_timeout=60)
+        db = ZODB.DB(storage, cache_size=config.cache_size, cache_size_bytes=config.cache_size_bytes)
+        logger.info(f"Opened {config.path} on ZEO server {config.zeo_address} in {time.perf_counter() - start:.2f}s")
+        return db
+    directory = os.path.dirname(config.path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    storage = ZODB.FileStorage.FileStorage(config.path, pack_keep_old=config.mode == "file")
+    db = ZODB.DB(storage, cache_size=config.cache_size, cache_size_bytes=config.cache_size_bytes)
+    size = os.path.getsize(config.path)
+    file_size.labels(config.path).set(size)
+    logger.info(f"Opened {config.path} ({size / 1e6:.1f}MB) in {time.perf_counter() - start:.2f}s")
+    return db
+
+def run_transaction(conn, tm, func, write: bool, command: str):
+    """Run func(conn) in a transaction of tm, committing it if write, and retry it on
+    ConflictError with jittered backoff. Raises StorageBusyError after MAX_COMMIT_ATTEMPTS."""
+    for attempt in range(1, MAX_COMMIT_ATTEMPTS + 1):
+        start = time.perf_counter()
+        tm.begin()
+        try:
+            result = func(conn)
+            if write:
+                tm.commit()
+            else:
+                tm.abort()
+            return result
+        except ConflictError as e:
+            tm.abort()
+            if attempt == MAX_COMMIT_ATTEMPTS:
+                conflict_failures.labels(command).inc()
+                logger.warning(f"Giving up on transaction after {attempt} conflicts: {e}")
+                raise StorageBusyError("The bot is busy right now, please try again in a moment.") from e
+            conflict_retries.labels(command).inc()
+            logger.info(f"Conflict committing transaction, retrying (attempt {attempt})")
+            # Jittered exponential backoff, so the transactions that collided spread out
+            # further each time instead of colliding again
+            time.sleep(random.uniform(0, min(MAX_CONFLICT_BACKOFF, CONFLICT_BACKOFF * 2 ** (attempt - 1))))
+        except BaseException:
+            tm.abort()
+            raise
+        finally:
+            transaction_latency.labels(command).observe(time.perf_counter() - start)
+
+def run_startup(db, func):
+    """Run func(conn) in a committed transaction on the calling thread, retrying on conflicts
+    like StorageExecutor does. For setup before the pool exists: on a shared ZEO database
+    other processes may be starting up at the same time."""
+    tm = transaction.TransactionManager(explicit=True)
+    conn = db.open(tm)
+    try:
+        return run_transaction(conn, tm, func, True, "startup")
+    finally:
+        conn.close()
+
+class StorageExecutor:
+    """Runs ZODB transactions on a dedicated thread pool so storage I/O never blocks the event loop.
+
+    Each pool thread keeps its own connection and transaction manager for its lifetime, which
+    also keeps that connection's object cache warm between transactions. Transaction functions
+    receive the connection, run synchronously on the pool thread, and must return plain data
+    rather than persistent objects, since those belong to the thread's connection."""
+
+    def __init__(self, db, max_workers: int = 4):
+        self.db = db
+        self._local = threading.local()
+        self._connections = []
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="zodb")
+        self._closed = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            tm = transaction.TransactionManager(explicit=True)
+            conn = self.db.open(tm)
+            self._local.conn = conn
+            self._local.tm = tm
+            self._connections.append(conn)
+        return conn, self._local.tm
+
+    def _run(self, func, write: bool, command: str):
+        conn, tm = self._connection()
+        return run_transaction(conn, tm, func, write, command)
+
+    async def read(self, func):
+        """Run func(conn) in a read-only transaction on the pool and return its result"""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._run, func, False, current_command.get())
+
+    async def write(self, func):
+        """Run func(conn) in a transaction on the pool and commit it, retrying on ConflictError.
+        Raises StorageBusyError if it still conflicts after MAX_COMMIT_ATTEMPTS.
+
+        func may run more than once, so it should only touch conn."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._run, func, True, current_command.get())
+
+    async def pack(self, days: float = 0):
+        """Pack away revisions older than days, online. Commits continue while it runs;
+        it gets its own thread so it doesn't hold up the pool. On ZEO the server packs."""
+        path = self.db.storage.getName()
+        # A ZEO client's name is the server address, there's no file to measure
+        local = os.path.isfile(path)
+        start = time.perf_counter()
+        before = os.path.getsize(path) if local else 0
+        await asyncio.to_thread(self.db.pack, days=days)
+        elapsed = time.perf_counter() - start
+        pack_latency.labels(path).observe(elapsed)
+        if not local:
+            logger.info(f"Packed {path} in {elapsed:.1f}s")
+            return
+        after = os.path.getsize(path)
+        file_size.labels(path).set(after)
+        logger.info(f"Packed {path} from {before / 1e6:.1f}MB to {after / 1e6:.1f}MB in {elapsed:.1f}s")
+
+    def close(self):
+        """Finish pending transactions and close the database, which saves the FileStorage index"""
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.shutdown(wait=True)
+        for conn in self._connections:
+            conn.close()
+        self.db.close()
+
+async def run_packer(executor: StorageExecutor, interval: float, days: float):
+    """Pack executor's database every interval seconds, keeping days of history"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await executor.pack(days)
+        except Exception:
+            logger.exception(f"Packing {executor.db.storage.getName()} failed")
+
+async def monitor_loop_lag(interval: float = 0.05):
+    """Record how late the event loop wakes up for each tick. Anything blocking the loop,
+    such as a synchronous commit, shows up as lag in event_loop_lag_seconds."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, loop.time() - expected))
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 def is_valid_name(name: str) -> bool:
         if len(name) < 3 or len(name) > 30:
             return False
@@ -7,4 +9,31 @@ async def follow_up(interaction, message: str, ephemeral: bool = True):
     if interaction.response.is_done():
         await interaction.followup.send(message, ephemeral=ephemeral)
     else:
-        await interaction.response.send_message(message, ephemeral=ephemeral)
\ No newline at end of file
+        await interaction.response.send_message(message, ephemeral=ephemeral)
+
+class MessageCache:
+    """Small LRU of message handles so card edits can skip fetch_message.
+
+    Handles are PartialMessages built from stored channel/message IDs; editing or deleting
+    them is a single REST call, and a deleted message surfaces as discord.NotFound."""
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._messages = OrderedDict()
+
+    def get(self, guild, channel_id: int, message_id: int):
+        key = (channel_id, message_id)
+        message = self._messages.get(key, None)
+        if message is not None:
+            self._messages.move_to_end(key)
+            return message
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            return None
+        message = channel.get_partial_message(message_id)
+        self._messages[key] = message
+        if len(self._messages) > self.maxsize:
+            self._messages.popitem(last=False)
+        return message
+
+    def discard(self, channel_id: int, message_id: int):
+        self._messages.pop((channel_id, message_id), None)
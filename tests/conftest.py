@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The bot's modules are imported flat from src/, the way bot.py runs. The Discord fakes come
+# from bench/, after src/ since some benchmarks share a name with the module they measure.
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(_root, "src"))
+sys.path.append(os.path.join(_root, "bench"))
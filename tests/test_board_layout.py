@@ -0,0 +1,189 @@
+"""Board pages kept by incremental relayouts must always match a full sort of the guild's
+rooms, including when commands race each other while pages are being posted."""
+import asyncio
+import os
+import random
+import pytest
+from fake_discord import FakeAPI, FakeGuild, FakeInteraction, FakeMember, FakeRole, FakeTextChannel
+from board import BOARD_PAGE_SIZE, sort_entry
+from room import ConRoomManager, RoomStatus, RoomVibe
+from storage import StorageConfig
+
+HOTELS = ["Hyatt", "hilton", "Marriott"]
+
+class Con:
+    """A manager on a fresh database with one guild, its room channel and an admin"""
+    def __init__(self, path: str, latency: float = 0.0):
+        self.manager = ConRoomManager(storage_config=StorageConfig(path))
+        self.manager.render_queue.rate = 1000
+        self.manager.render_queue.debounce = 0
+        self.api = FakeAPI(latency=latency, jitter=latency / 2, rate=1000, per=1.0)
+        self.guild = FakeGuild()
+        self.channel = self.guild.add_channel(FakeTextChannel(self.api))
+        self.admin_role = FakeRole(manage_channels=True, administrator=True)
+        self.admin = FakeMember(self.guild, [self.admin_role])
+        self.rooms = set()
+
+    async def setup(self, mode: str = None):
+        def configure(conn):
+            conn.root.room_channels[self.guild.id] = self.channel.id
+            conn.root.admin_roles[self.guild.id] = self.admin_role.id
+        await self.manager.storage.write(configure)
+        if mode:
+            await self.manager.set_board_mode(self.interaction(), mode)
+
+    def interaction(self) -> FakeInteraction:
+        return FakeInteraction(self.api, self.guild, self.admin, self.channel)
+
+    async def create(self, hotel: str, room_number: int):
+        self.rooms.add((hotel, room_number))
+        await self.manager.create_room(self.interaction(), self.admin, hotel, room_number)
+
+    async def remove(self, hotel: str, room_number: int):
+        self.rooms.discard((hotel, room_number))
+        await self.manager.remove_room(self.interaction(), hotel, room_number)
+
+    async def check_board(self, mode: str, step=None):
+        """Pages match a full sort, every room points at its page and slot, and the channel
+        holds exactly the board's messages"""
+        await self.manager.render_queue.join()
+        def state(conn):
+            guild_rooms = conn.root.guilds[self.guild.id]
+            expected = sorted(sort_entry(mode, room, room_key) for room_key, room in guild_rooms.rooms.items())
+            keys = [entry[-1] for entry in expected]
+            assert [page.room_keys for page in guild_rooms.board] == \
+                [tuple(keys[i:i + BOARD_PAGE_SIZE]) for i in range(0, len(keys), BOARD_PAGE_SIZE)], step
+            for number, page in enumerate(guild_rooms.board):
+                assert page.message_id, step
+                assert page.first_entry == expected[number * BOARD_PAGE_SIZE], step
+                assert guild_rooms.board_index[page.message_id] is page, step
+                for slot, room_key in enumerate(page.room_keys):
+                    room = guild_rooms.rooms[room_key]
+                    assert (room.message_id, room.board_slot, room.channel_id) == (page.message_id, slot, self.channel.id), step
+            assert len(guild_rooms.board_index) == len(guild_rooms.board), step
+            return {page.message_id for page in guild_rooms.board}
+        assert await self.manager.storage.read(state) == set(self.channel.messages), step
+
+    def close(self):
+        self.manager.close()
+
+@pytest.fixture
+def con(tmp_path):
+    cons = []
+    def con(latency: float = 0.0):
+        cons.append(Con(os.path.join(tmp_path, f"rooms{len(cons)}.fs"), latency))
+        return cons[-1]
+    yield con
+    for opened in cons:
+        opened.close()
+
+def random_room(rng: random.Random):
+    # Room number 0 can't be looked up by hotel and number
+    return rng.choice(HOTELS), rng.randrange(1, 500)
+
+async def random_command(con: Con, rng: random.Random):
+    manager = con.manager
+    choice = rng.random()
+    if choice < 0.3 or len(con.rooms) < 5:
+        hotel, room_number = random_room(rng)
+        if (hotel, room_number) not in con.rooms:
+            await con.create(hotel, room_number)
+    elif choice < 0.5:
+        await con.remove(*rng.choice(sorted(con.rooms)))
+    elif choice < 0.85:
+        hotel, room_number = rng.choice(sorted(con.rooms))
+        await manager.update_room_status(con.interaction(), rng.choice(list(RoomStatus)), rng.choice(list(RoomVibe)),
+                                         None, hotel, room_number)
+    else:
+        hotel, room_number = rng.choice(sorted(con.rooms))
+        new_hotel, new_room_number = random_room(rng)
+        if (new_hotel, new_room_number) not in con.rooms:
+            con.rooms.discard((hotel, room_number))
+            con.rooms.add((new_hotel, new_room_number))
+            await manager.update_room_info(con.interaction(), hotel, room_number, new_hotel, new_room_number)
+
+@pytest.mark.parametrize("mode", ["location", "status"])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_relayout_matches_full_sort(con, mode, seed):
+    async def run():
+        rng = random.Random(seed)
+        board = con()
+        await board.setup()
+        for _ in range(40):
+            hotel, room_number = random_room(rng)
+            if (hotel, room_number) not in board.rooms:
+                await board.create(hotel, room_number)
+        await board.manager.set_board_mode(board.interaction(), mode)
+        await board.check_board(mode, "initial")
+        for step in range(150):
+            await random_command(board, rng)
+            await board.check_board(mode, step)
+    asyncio.run(run())
+
+@pytest.mark.parametrize("mode", ["location", "status"])
+def test_concurrent_commands_keep_board_consistent(con, mode):
+    async def run():
+        rng = random.Random(7)
+        board = con(latency=0.005)
+        await board.setup(mode)
+        for room_number in range(1, 31):
+            await board.create(rng.choice(HOTELS), room_number)
+        for _ in range(5):
+            # Each command owns distinct rooms so none of them fails on another's change
+            fresh = [(rng.choice(HOTELS), room_number) for room_number in rng.sample(range(100, 500), 8)]
+            fresh = [room for room in dict.fromkeys(fresh) if room not in board.rooms]
+            doomed = rng.sample(sorted(board.rooms), 6)
+            moved = [room for room in sorted(board.rooms) if room not in doomed][:6]
+            await asyncio.gather(
+                *(board.create(*room) for room in fresh),
+                *(board.remove(*room) for room in doomed),
+                *(board.manager.update_room_status(board.interaction(), rng.choice(list(RoomStatus)), RoomVibe.CHILL,
+                                                   None, *room) for room in moved))
+            await board.check_board(mode)
+    asyncio.run(run())
+
+class HeldSends:
+    """Holds the room channel's next send until released, to land other commands mid-post"""
+    def __init__(self, channel: FakeTextChannel):
+        self.channel = channel
+        self.send = channel.send
+        self.sending = asyncio.Event()
+        self.release = asyncio.Event()
+        channel.send = self.held_send
+
+    async def held_send(self, *args, **fields):
+        self.channel.send = self.send
+        self.sending.set()
+        await self.release.wait()
+        return await self.send(*args, **fields)
+
+def test_remove_while_board_page_posts(con):
+    async def run():
+        board = con()
+        await board.setup("location")
+        for room_number in range(1, BOARD_PAGE_SIZE + 1):
+            await board.create("Hyatt", room_number)
+        held = HeldSends(board.channel)
+        # Needs a second page, whose post is held
+        create = asyncio.create_task(board.create("Hyatt", 50))
+        await held.sending.wait()
+        await board.remove("Hyatt", 50)
+        held.release.set()
+        await create
+        await board.check_board("location")
+    asyncio.run(run())
+
+def test_remove_while_card_posts(con):
+    async def run():
+        cards = con()
+        await cards.setup()
+        held = HeldSends(cards.channel)
+        create = asyncio.create_task(cards.create("Hyatt", 101))
+        await held.sending.wait()
+        await cards.remove("Hyatt", 101)
+        held.release.set()
+        with pytest.raises(ValueError):
+            await create
+        # The card posted for the removed room was taken down again
+        assert cards.channel.messages == {}
+    asyncio.run(run())
@@ -0,0 +1,109 @@
+"""Opening a database written by the original single-tree layout, which runs the one-time
+migration into per-guild GuildRooms. It can't be undone, so no room may be lost."""
+import os
+from datetime import datetime, timezone
+import persistent
+import ZODB, ZODB.FileStorage
+from BTrees import OOBTree
+import pytest
+import room
+from room import ConRoomManager, RoomStatus
+from storage import StorageConfig
+
+GUILD_A = 1001
+GUILD_B = 1002
+CHANNEL_A = 2001
+CHANNEL_B = 2002
+OLD_CHANNEL = 2999
+
+class BaselineRoom(persistent.Persistent):
+    """Room as the original layout stored it: a plain instance dict with no guild_id"""
+    status = RoomStatus.OPEN
+    room_name = None
+
+    def __init__(self, owner_id: int, hotel: str, room_number: int, channel_id: int, message_id: int, room_name: str = None):
+        self.members = [owner_id]
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.hotel = hotel
+        self.room_number = room_number
+        self.room_name = room_name
+        self.last_updated = datetime.now(timezone.utc)
+
+# Pickled under the name the real class is loaded by
+BaselineRoom.__module__ = "room"
+BaselineRoom.__name__ = BaselineRoom.__qualname__ = "Room"
+
+def write_baseline_db(path: str, room_channels: dict, rooms: list, monkeypatch):
+    """Write a rooms.fs the way the original ConRoomManager laid it out"""
+    with monkeypatch.context() as patch:
+        patch.setattr(room, "Room", BaselineRoom)
+        db = ZODB.DB(ZODB.FileStorage.FileStorage(path))
+        with db.transaction() as conn:
+            conn.root.rooms = OOBTree.BTree()
+            conn.root.room_channels = OOBTree.BTree(room_channels)
+            conn.root.admin_roles = OOBTree.BTree()
+            for baseline_room in rooms:
+                conn.root.rooms[f"{baseline_room.hotel}-{baseline_room.room_number}"] = baseline_room
+        db.close()
+
+@pytest.fixture
+def open_manager(tmp_path):
+    managers = []
+    def open_manager():
+        manager = ConRoomManager(storage_config=StorageConfig(os.path.join(tmp_path, "rooms.fs")))
+        managers.append(manager)
+        return manager
+    yield open_manager
+    for manager in managers:
+        manager.close()
+
+def snapshot(manager: ConRoomManager):
+    with manager.db.transaction() as conn:
+        guilds = {guild_id: {room_key: (stored.guild_id, stored.members, stored.room_name, stored.channel_id)
+                             for room_key, stored in guild_rooms.rooms.items()}
+                  for guild_id, guild_rooms in conn.root.guilds.items()}
+        unassigned = sorted(getattr(conn.root, 'unassigned_rooms', None) or ())
+        return guilds, unassigned, hasattr(conn.root, 'rooms')
+
+def test_single_guild_keeps_rooms_from_earlier_channels(tmp_path, monkeypatch, open_manager):
+    write_baseline_db(os.path.join(tmp_path, "rooms.fs"), {GUILD_A: CHANNEL_A}, [
+        BaselineRoom(11, "Hyatt", 101, CHANNEL_A, 5001, "den"),
+        # Posted before the room channel was set again
+        BaselineRoom(12, "Hyatt", 102, OLD_CHANNEL, 5002),
+    ], monkeypatch)
+
+    guilds, unassigned, kept_global_rooms = snapshot(open_manager())
+
+    assert guilds == {GUILD_A: {
+        "Hyatt-101": (GUILD_A, (11,), "den", CHANNEL_A),
+        "Hyatt-102": (GUILD_A, (12,), None, OLD_CHANNEL),
+    }}
+    assert unassigned == []
+    assert not kept_global_rooms
+
+def test_unassignable_rooms_are_kept(tmp_path, monkeypatch, open_manager):
+    write_baseline_db(os.path.join(tmp_path, "rooms.fs"), {GUILD_A: CHANNEL_A, GUILD_B: CHANNEL_B}, [
+        BaselineRoom(11, "Hyatt", 101, CHANNEL_A, 5001),
+        BaselineRoom(12, "Hilton", 201, CHANNEL_B, 5002),
+        BaselineRoom(13, "Hyatt", 102, OLD_CHANNEL, 5003, "lost"),
+    ], monkeypatch)
+
+    guilds, unassigned, kept_global_rooms = snapshot(open_manager())
+
+    assert sorted(guilds[GUILD_A]) == ["Hyatt-101"]
+    assert sorted(guilds[GUILD_B]) == ["Hilton-201"]
+    assert unassigned == ["Hyatt-102"]
+    assert kept_global_rooms
+
+def test_migration_runs_once(tmp_path, monkeypatch, open_manager):
+    write_baseline_db(os.path.join(tmp_path, "rooms.fs"), {GUILD_A: CHANNEL_A, GUILD_B: CHANNEL_B}, [
+        BaselineRoom(11, "Hyatt", 101, CHANNEL_A, 5001),
+        BaselineRoom(13, "Hyatt", 102, OLD_CHANNEL, 5003),
+    ], monkeypatch)
+    first = open_manager()
+    migrated = snapshot(first)
+    first.close()
+
+    # Reopening must not migrate the kept global tree again or touch unassigned_rooms
+    assert snapshot(open_manager()) == migrated